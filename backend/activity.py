@@ -0,0 +1,72 @@
+# Write-behind recording of users' last activity: authenticated requests only update an
+# in-memory map, which a background thread writes to the database in batches. An activity
+# is only recorded if it is at least `granularity` seconds newer than the user's last one.
+from datetime import timedelta
+from threading import Thread, Lock
+from time import sleep
+import atexit
+import os
+import sys
+
+class ActivityRecorder:
+
+    def __init__(self, write, granularity, flush_interval):
+        self.write = write # write({user key: datetime}) persists a batch
+        self.granularity = timedelta(seconds=granularity)
+        self.flush_interval = flush_interval
+        self.pending = {} # user key -> last activity not yet written
+        self.recorded = {} # user key -> last activity recorded (pending or written)
+        self.lock = Lock()
+        self.thread = None
+        atexit.register(self.flush)
+        os.register_at_fork(after_in_child=self.forget)
+        try:
+            import uwsgi
+            chained_atexit = getattr(uwsgi, "atexit", None)
+            def uwsgi_atexit(): # python's atexit is not called when a uWSGI worker is reloaded
+                self.flush()
+                if chained_atexit:
+                    chained_atexit()
+            uwsgi.atexit = uwsgi_atexit
+        except ImportError:
+            pass
+
+    def touch(self, key, now):
+        last = self.recorded.get(key)
+        if last is not None and now - last < self.granularity:
+            return
+        with self.lock:
+            self.recorded[key] = now
+            self.pending[key] = now
+        if self.thread is None:
+            self.start() # started lazily, so that the thread runs in the (forked) worker process
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, {}
+        if not batch:
+            return
+        try:
+            self.write(batch)
+        except Exception as e:
+            print(f"error writing last activity of {len(batch)} users: {e}", file=sys.stderr)
+            with self.lock:
+                for key, activity in batch.items(): # retried on the next flush, unless superseded
+                    self.pending.setdefault(key, activity)
+
+    # pending activities belong to the parent process, which writes them
+    def forget(self):
+        self.lock = Lock()
+        self.pending = {}
+        self.thread = None
@@ -0,0 +1,202 @@
+# Asynchronous serving mode, e.g. `uvicorn asgi:app` (requires the packages in requirements-asgi.txt).
+# GET requests to the data endpoints are handled in the event loop: connectors with an
+# async_handler query InfluxDB or opendatasoft without holding a thread, and others run in a
+# thread. Authentication, rate limits, CORS and the responses are those of the Flask app,
+# whose request context is pushed for each request. All other requests (/auth, /metadata,
+# /<name>/stream, profiled requests, ...) are passed to the Flask app, each in a thread.
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from time import perf_counter
+from urllib.parse import parse_qs
+import asyncio
+import os
+import sys
+
+if os.environ.get("ENV") == "local":
+    from .backend import app as flask_app, cfg_auth, data_endpoints, derived_metrics_request, data_response, instrument_response, COALESCED_ENDPOINTS
+    from .single_flight import flights, args_key
+    from .connectors.common import phases
+    from .connectors.common.influxdb_clients import close_async_clients
+    from .connectors.common.opendatasoft import close_async_session
+else:
+    from backend import app as flask_app, cfg_auth, data_endpoints, derived_metrics_request, data_response, instrument_response, COALESCED_ENDPOINTS
+    from single_flight import flights, args_key
+    from connectors.common import phases
+    from connectors.common.influxdb_clients import close_async_clients
+    from connectors.common.opendatasoft import close_async_session
+from flask import request
+from flask_login import current_user
+
+# requests passed to the Flask app; long-lived /<name>/stream responses each hold a thread
+wsgi_executor = ThreadPoolExecutor(max_workers=cfg_auth.get("asgi_wsgi_threads", 32))
+
+# the connector's handler as a coroutine function
+def async_connector_handler(handler):
+    async_handler = getattr(handler, "async_handler", None)
+    if async_handler:
+        return async_handler
+    async def threaded_handler(args):
+        return await asyncio.to_thread(handler, args)
+    return threaded_handler
+
+# same wrapping as configure_handler in backend.py, with the async connector handlers
+def generate_async_handler(name, endpoint):
+    handler = async_connector_handler(endpoint["handler"])
+    derived_metrics = endpoint["derived_metrics"]
+    pushed_down = endpoint["pushed_down"]
+    async def derived_metrics_handler(args):
+        connector_args, finish = derived_metrics_request(args, derived_metrics, pushed_down)
+        return finish(await handler(connector_args))
+    if name not in COALESCED_ENDPOINTS:
+        return derived_metrics_handler
+    flight = flights[name]
+    async def coalesced_handler(args):
+        return await flight.do_async(args_key(args), lambda: derived_metrics_handler(args))
+    return coalesced_handler
+
+async_handlers = {"/" + name: generate_async_handler(name, endpoint) for name, endpoint in data_endpoints.items()}
+
+# path within the application, which may be mounted under root_path
+def app_path(scope):
+    root_path = scope.get("root_path", "")
+    return scope["path"][len(root_path):] if root_path and scope["path"].startswith(root_path) else scope["path"]
+
+def build_environ(scope, body):
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    client = scope.get("client")
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": app_path(scope).encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": client[0] if client else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.input_terminated": True, # the whole body has been read
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for header_name, value in scope["headers"]:
+        header_name = header_name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if header_name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[header_name] = value
+            continue
+        key = "HTTP_" + header_name
+        environ[key] = environ[key] + "," + value if key in environ else value
+    return environ
+
+async def read_body(receive):
+    body = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        body.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    return b"".join(body)
+
+def is_async_request(scope, handler):
+    if handler is None or scope["method"] not in ("GET", "HEAD"):
+        return False
+    # profiling samples the request's thread (see profiled in backend.py)
+    profile = "profile" in parse_qs(scope["query_string"].decode("latin-1")) or any(name == b"x-profile" for name, _ in scope["headers"])
+    return not profile
+
+# runs the data endpoint's handler as the Flask app would (see configure_handler in backend.py)
+async def dispatch(handler, stream):
+    rv = flask_app.preprocess_request() # before_request functions, e.g. the rate limiter
+    if rv is None:
+        authenticated = await asyncio.to_thread(lambda: current_user.is_authenticated) # loads the user, possibly from the database
+        if not authenticated:
+            rv = flask_app.login_manager.unauthorized()
+        else:
+            rv = data_response(await handler(request.args), stream)
+    return flask_app.process_response(flask_app.make_response(rv)) # after_request functions and the session cookie
+
+async def handle_async(scope, receive, send, handler, name):
+    environ = build_environ(scope, await read_body(receive))
+    endpoint = data_endpoints[name]
+    with flask_app.request_context(environ):
+        start_time = perf_counter()
+        request_phases = phases.RequestPhases()
+        token = phases.current.set(request_phases)
+        try:
+            try:
+                response = await dispatch(handler, endpoint["stream"])
+            except Exception as e:
+                try:
+                    response = flask_app.process_response(flask_app.make_response(flask_app.handle_user_exception(e)))
+                except Exception as e:
+                    response = flask_app.handle_exception(e) # a 500 response, unless exceptions are propagated
+        finally:
+            phases.current.reset(token)
+        response = instrument_response(response, request_phases, start_time, name, endpoint["connector"])
+        headers = response.get_wsgi_headers(environ)
+    try:
+        await send({"type": "http.response.start", "status": response.status_code, "headers": [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in headers.items()]})
+        if scope["method"] != "HEAD" and response.status_code not in (204, 304):
+            for chunk in response.response:
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        response.close()
+
+# runs the Flask app in a thread of wsgi_executor, which sends the response's chunks as they're produced
+def run_wsgi(environ, loop, send):
+    def send_message(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+    started = {}
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in headers]
+    body = flask_app(environ, start_response)
+    try:
+        sent_start = False
+        for chunk in body:
+            if not chunk:
+                continue
+            if not sent_start:
+                send_message({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+                sent_start = True
+            send_message({"type": "http.response.body", "body": chunk, "more_body": True})
+        if not sent_start:
+            send_message({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+        send_message({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+
+async def handle_wsgi(scope, receive, send):
+    environ = build_environ(scope, await read_body(receive))
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(wsgi_executor, run_wsgi, environ, loop, send)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_async_clients()
+            await close_async_session()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return # e.g. websockets, not used
+    path = app_path(scope)
+    handler = async_handlers.get(path)
+    if is_async_request(scope, handler):
+        await handle_async(scope, receive, send, handler, path[1:])
+    else:
+        await handle_wsgi(scope, receive, send)
@@ -1,10 +1,10 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, stream_with_context
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from sqlalchemy.exc import IntegrityError
 from importlib import import_module
-from os import listdir, environ
+from os import listdir, environ, stat
 import yaml
 from yaml.loader import SafeLoader
 import json
@@ -12,7 +12,15 @@ import re
 from datetime import datetime
 from uuid import uuid4
 from time import perf_counter
+from threading import Lock
+import hashlib
+import hmac
+import gzip
 import sys
+try:
+    import brotli # optional, /metadata is also served brotli-compressed if available
+except ImportError:
+    brotli = None
 
 config_file = environ["CONFIG"] if "CONFIG" in environ else "config.yml"
 with open(config_file, encoding="utf-8") as f:
@@ -31,10 +39,18 @@ if LOCAL_ENV:
     app.config["CORS_SUPPORTS_CREDENTIALS"] = True
     app.config["SESSION_COOKIE_SAMESITE"] = "None"
     LIMITER_STORAGE_URI = "memory://"
-    from .parse_derived_metrics import add_derived_metrics
-    from .db_model import db, User, Role
-    from .hash import gen_hash, check_hash
-    from .send_email import send_email
+    from .parse_derived_metrics import add_derived_metrics, compile_derived_metrics
+    from .db_model import db, User, Role, Email
+    from .hash import gen_hash, check_hash, configure_hashing, HashingBusy
+    from .send_email import SMTPTransport, LogTransport
+    from .outbox import Outbox
+    from .activity import ActivityRecorder
+    from .ttl_cache import TTLCache
+    from .timeseries_format import encode as encode_timeseries, MIMETYPE as TIMESERIES_MIMETYPE
+    from .single_flight import coalesce, flights
+    from .instrumentation import TimedBody, observe_request, render as render_metrics, counter_sources
+    from .connectors.common import phases
+    from .profiler import SamplingProfiler, ProfileGate
     from .connectors import influxdb_live as live
     from .connectors import influxdb_history as history
     from .connectors import prediction as prediction
@@ -44,10 +60,18 @@ if LOCAL_ENV:
 else:
     app.config["SESSION_COOKIE_SECURE"] = True
     LIMITER_STORAGE_URI = "memcached://memcached:11211"
-    from parse_derived_metrics import add_derived_metrics
-    from db_model import db, User, Role
-    from hash import gen_hash, check_hash
-    from send_email import send_email
+    from parse_derived_metrics import add_derived_metrics, compile_derived_metrics
+    from db_model import db, User, Role, Email
+    from hash import gen_hash, check_hash, configure_hashing, HashingBusy
+    from send_email import SMTPTransport, LogTransport
+    from outbox import Outbox
+    from activity import ActivityRecorder
+    from ttl_cache import TTLCache
+    from timeseries_format import encode as encode_timeseries, MIMETYPE as TIMESERIES_MIMETYPE
+    from single_flight import coalesce, flights
+    from instrumentation import TimedBody, observe_request, render as render_metrics, counter_sources
+    from connectors.common import phases
+    from profiler import SamplingProfiler, ProfileGate
     import connectors.influxdb_live as live
     import connectors.influxdb_history as history
     import connectors.prediction as prediction
@@ -87,12 +111,44 @@ def response_not_exists():
 def too_many_requests(_):
     return jsonify({'message': 'Too many requests'}), 429
 
+configure_hashing(cfg_auth.get("hash_rounds"), cfg_auth.get("hash_target_ms", 250), cfg_auth.get("hash_workers", 1), cfg_auth.get("hash_queue_size", 16), cfg_auth.get("hash_python"))
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(_):
+    return jsonify({'message': 'Server busy, try again later'}), 503
+
+# users' last_activity is written in batches, off the request path (see activity.py);
+# users deleted in the meantime are just not matched
+def write_last_activity(batch):
+    table = User.__table__
+    statement = db.update(table).where(table.c.email == db.bindparam("user_email")).values(last_activity=db.bindparam("user_activity"))
+    with app.app_context():
+        db.session.execute(statement, [{"user_email": email, "user_activity": activity} for email, activity in batch.items()])
+        db.session.commit()
+
+activity = ActivityRecorder(write_last_activity, cfg_auth.get("activity_granularity", 60), cfg_auth.get("activity_flush_interval", 30))
+
+# users are cached by unique_token for a few seconds, so that most authenticated requests don't
+# query the database; entries are removed when a user's token or role changes in this process
+# (other processes see the change once their entry expires)
+user_cache = TTLCache(cfg_auth.get("user_cache_size", 1000), cfg_auth.get("user_cache_ttl", 10))
+
+# copy of the fields used by the request handlers, not bound to any session, so that it
+# can be shared between requests; users must therefore be compared by email
+def detached_user(user):
+    return User(email=user.email, unique_token=user.unique_token, name=user.name, role=user.role)
+
 @login_manager.user_loader
 def load_user(user_id):
-    user = db.session.scalars(db.select(User).where(User.unique_token == user_id)).first()
-    if user:
-        user.last_activity = datetime.now()
-        db.session.commit()
+    with phases.timed("auth"):
+        user = user_cache.get(user_id)
+        if user is None:
+            user = db.session.scalars(db.select(User).where(User.unique_token == user_id)).first()
+            if not user:
+                return None
+            user = detached_user(user)
+            user_cache.put(user_id, user)
+    activity.touch(user.email, datetime.now())
     return user
 
 @login_manager.unauthorized_handler
@@ -119,7 +175,9 @@ def login():
 @app.route('/auth/logout')
 @login_required
 def logout():
+    unique_token = current_user.unique_token
     logout_user()
+    user_cache.remove(unique_token)
     return jsonify({'message': 'Logged out successfully'})
 
 
@@ -135,13 +193,20 @@ def create_first_user():
     db.session.add(user)
     db.session.commit()
 
+# emails are delivered by a background sender (see outbox.py); "log" prints them instead
+if cfg_auth.get("email_transport", "log") == "smtp":
+    email_transport = SMTPTransport(cfg_auth["email_sender"], cfg_auth["email_password"], cfg_auth.get("email_smtp_host", "smtp.gmail.com"), cfg_auth.get("email_smtp_port", 465))
+else:
+    email_transport = LogTransport()
+outbox = Outbox(app, db, Email, email_transport, cfg_auth["email_sender"], cfg_auth.get("email_retry_interval", 30), max_attempts=cfg_auth.get("email_max_attempts", 5), max_age=cfg_auth.get("email_max_age", 86400))
+# started lazily in each worker process, so that emails left pending by a previous run are delivered too
+app.before_request(outbox.start)
+
+# queued in the current session, to be committed along with the change that requires it
 def send_activation_email(uuid, email):    
     subject = "crowdingVisualization activation link"
     body = "Activation link: http://localhost:3000/activate?email={}&uuid={}".format(email, uuid) # TODO hostname configuration
-    sender = cfg_auth["email_sender"]
-    password = cfg_auth["email_password"]
-    print(body, file=sys.stderr)
-    # send_email(subject, body, sender, email, password) # TODO uncomment
+    outbox.enqueue(email, subject, body)
 
 def is_admin(user):
     return user.role in (Role.superuser, Role.admin)
@@ -176,9 +241,9 @@ def create():
 
     user_to_activate = User(email=email, role=role, validation_hash=uuid_hash, name=name)
     db.session.add(user_to_activate)
-    db.session.commit()
-    
     send_activation_email(new_uuid, email)
+    db.session.commit()
+    outbox.wake()
 
     return response_ok()
 
@@ -189,15 +254,17 @@ def delete_user():
     email = data.get('email')
 
     user = db.session.get(User, email)
-    if not is_admin(current_user) and user != current_user: # regular user can only delete itself
+    if not is_admin(current_user) and (not user or user.email != current_user.email): # regular user can only delete itself
         return response_unauthorized()
     if not user:
         return response_not_exists()
     if user.role == Role.superuser:
         return jsonify({"message": "Cannot delete superuser"}), 401
 
+    unique_token = user.unique_token
     db.session.delete(user)
     db.session.commit()
+    user_cache.remove(unique_token)
 
     return response_ok()
 
@@ -210,7 +277,7 @@ def change_password():
 
     user = db.session.get(User, email)
 
-    if not user or not user.unique_token or user != current_user:
+    if not user or not user.unique_token or user.email != current_user.email:
         return response_not_exists()
     
     if password is not None:
@@ -218,11 +285,13 @@ def change_password():
     else:
         pwd_hash = user.pwd_hash
 
+    old_unique_token = user.unique_token
     while True:
         try:
             user.pwd_hash = pwd_hash
             user.unique_token = str(uuid4())
             db.session.commit()
+            user_cache.remove(old_unique_token)
             
             logout_user()
             return response_ok()
@@ -248,6 +317,7 @@ def change_role():
     
     user.role = Role.admin if is_admin else Role.regular
     db.session.commit()
+    user_cache.remove(user.unique_token)
     
     return response_ok()
 
@@ -264,12 +334,15 @@ def activate_user():
         return response_not_exists()
     
     pwd_hash = gen_hash(password)
+    old_unique_token = user_to_activate.unique_token # set when reactivating after forgot_password
     while True: # loop until generated uuid is unique
         try:
             user_to_activate.pwd_hash = pwd_hash
             user_to_activate.validation_hash = None
             user_to_activate.unique_token = str(uuid4())
             db.session.commit()
+            if old_unique_token:
+                user_cache.remove(old_unique_token)
             return response_ok()
         except IntegrityError:
             db.session.rollback()
@@ -287,9 +360,9 @@ def forgot_password():
 
     uuid = str(uuid4())
     user.validation_hash = gen_hash(uuid)
-    db.session.commit()
-
     send_activation_email(uuid, email)
+    db.session.commit()
+    outbox.wake()
 
     return response_ok()
 
@@ -314,25 +387,128 @@ def user_list():
 connectors = {}
 
 # wrapper handler for derived metrics
-def derived_metrics_handler(handler, derived_metrics):
+# adds the derived metrics to the connector's result; with ?metrics=<comma separated names>,
+# only the base metrics they need are requested from the connector (connectors that can't
+# select metrics return all of them), only those derived metrics are computed and only the
+# requested metrics are returned. Derived metrics in pushed_down are requested from the
+# connector, which computes them itself
+def derived_metrics_handler(handler, derived_metrics, pushed_down=frozenset()):
     def wrapped_handler(args):
-        start_time = perf_counter()
-        res = handler(args)
-        add_derived_metrics(res, derived_metrics)
-        end_time = perf_counter()
-        print("backend total, minus jsonify: {}".format(end_time - start_time), file=sys.stderr)
-        return res
+        connector_args, finish = derived_metrics_request(args, derived_metrics, pushed_down)
+        return finish(handler(connector_args))
     return wrapped_handler
 
+# returns the arguments for the connector and the function that completes its result
+def derived_metrics_request(args, derived_metrics, pushed_down):
+    metrics = args.get("metrics")
+    if not metrics:
+        def finish(res):
+            with phases.timed("derived_metrics"):
+                return add_derived_metrics(res, derived_metrics)
+        return args, finish
+    metrics = metrics.split(",")
+    pushed_metrics = [metric for metric in metrics if metric in pushed_down]
+    base_metrics, requested_derived_metrics = derived_metrics.requirements([metric for metric in metrics if metric not in pushed_down])
+    args = args.copy()
+    args["metrics"] = ",".join(base_metrics + pushed_metrics)
+    def finish(res):
+        with phases.timed("derived_metrics"):
+            res = add_derived_metrics(res, derived_metrics, requested_derived_metrics)
+        if "values" in res:
+            res = dict(res, values={metric: res["values"][metric] for metric in metrics if metric in res["values"]})
+        return res
+    return args, finish
 
-def time_endpoint(f):
-    def timed_handler(args):
+# records the phases of each request to an endpoint in histograms (see instrumentation.py):
+# those timed while the handler runs (auth, query, assembly, derived_metrics, serialization)
+# and, once the server closes the response, the serialization of streamed bodies and sending
+def instrument(handler, name, connector):
+    def instrumented_handler():
         start_time = perf_counter()
-        res = f(args)
+        request_phases = phases.RequestPhases()
+        token = phases.current.set(request_phases)
+        try:
+            response = app.make_response(handler())
+        finally:
+            phases.current.reset(token)
+        return instrument_response(response, request_phases, start_time, name, connector)
+    instrumented_handler.__name__ = handler.__name__
+    return instrumented_handler
+
+def instrument_response(response, request_phases, start_time, name, connector):
+    sending_start_time = perf_counter()
+    def on_close(serialization, size):
         end_time = perf_counter()
-        print("backend total: {}".format(end_time - start_time), file=sys.stderr)
-        return res
-    return timed_handler
+        request_phases.add("serialization", serialization)
+        request_phases.add("send", end_time - sending_start_time - serialization)
+        observe_request(name, connector, request_phases.durations, end_time - start_time, size)
+    response.response = TimedBody(response.iter_encoded(), response.response, on_close)
+    return response
+
+profile_gate = ProfileGate(cfg_auth.get("profile_min_interval", 10))
+PROFILE_INTERVAL_SECONDS = cfg_auth.get("profile_interval_ms", 5) / 1000
+
+# with ?profile=1 or an X-Profile header, admins get the request's folded stacks (see
+# profiler.py), to be rendered as a flamegraph, instead of its response; others' flags are ignored
+def profiled(handler, name):
+    def profiled_handler():
+        if not (request.headers.get("X-Profile") or request.args.get("profile")) or not is_admin(current_user):
+            return handler()
+        if not profile_gate.acquire():
+            return jsonify({'message': 'Too many profiled requests'}), 429
+        try:
+            profiler = SamplingProfiler(PROFILE_INTERVAL_SECONDS)
+            start_time = perf_counter()
+            profiler.start()
+            try:
+                response = app.make_response(handler())
+                response.get_data() # streamed responses are serialized while they're read
+                response.close()
+            finally:
+                profiler.stop()
+            duration = perf_counter() - start_time
+        finally:
+            profile_gate.release()
+        headers = {
+            "Content-Disposition": 'attachment; filename="{}.folded"'.format(name),
+            "X-Profile-Duration": "{:.3f}".format(duration),
+            "X-Profile-Samples": str(sum(profiler.stacks.values())),
+        }
+        return app.response_class(profiler.folded(), mimetype="text/plain", headers=headers)
+    profiled_handler.__name__ = handler.__name__
+    return profiled_handler
+
+def metrics_counters():
+    return [
+        ("crowding_requests_total", "Requests to endpoints that coalesce identical concurrent requests", {(name,): flight.requests for name, flight in flights.items()}, ("endpoint",)),
+        ("crowding_coalesced_requests_total", "Requests answered with the result of an identical concurrent request", {(name,): flight.coalesced for name, flight in flights.items()}, ("endpoint",)),
+        ("crowding_user_cache_lookups_total", "Lookups of authenticated users in the cache", {("hit",): user_cache.hits, ("miss",): user_cache.misses}, ("result",)),
+        ("crowding_chunk_cache_lookups_total", "Lookups of history chunks in the cache", chunk_cache_lookups(), ("endpoint", "result")),
+    ]
+
+def chunk_cache_lookups():
+    lookups = {}
+    for name, endpoint in data_endpoints.items():
+        cache = getattr(endpoint["handler"], "chunk_cache", None)
+        if cache is not None:
+            lookups[(name, "hit")] = cache.hits
+            lookups[(name, "miss")] = cache.misses
+    return lookups
+
+counter_sources.append(metrics_counters)
+
+# Prometheus metrics of this process; scrapers authenticate with the metrics_token bearer
+# token if it's configured, otherwise only admins may read them
+@app.route('/metrics')
+def metrics():
+    metrics_token = cfg_auth.get("metrics_token")
+    if metrics_token:
+        authorized = hmac.compare_digest(request.headers.get("Authorization", ""), "Bearer " + metrics_token)
+    else:
+        authorized = current_user.is_authenticated and is_admin(current_user)
+    if not authorized:
+        return response_unauthorized()
+    return app.response_class(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 ### Code to be executed on load
 
@@ -343,40 +519,187 @@ with app.app_context():
     if not has_users:
         create_first_user()
 
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# serializes a result piece by piece (each location array separately), yielding chunks of
+# about STREAM_CHUNK_SIZE characters, so that the whole JSON string is never held in memory
+def json_chunks(res):
+    buffer = []
+    buffer_size = 0
+    for piece in json_pieces(res):
+        buffer.append(piece)
+        buffer_size += len(piece)
+        if buffer_size >= STREAM_CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer = []
+            buffer_size = 0
+    yield "".join(buffer)
+
+def json_pieces(obj):
+    if not isinstance(obj, dict):
+        yield json.dumps(obj)
+        return
+    yield "{"
+    for i, key in enumerate(obj):
+        yield (", " if i > 0 else "") + json.dumps(key) + ": "
+        yield from json_pieces(obj[key])
+    yield "}"
+
+def accepts_binary():
+    return request.accept_mimetypes.best_match(["application/json", TIMESERIES_MIMETYPE]) == TIMESERIES_MIMETYPE
+
+# the result in the compact binary time series format, if the client accepts it and the
+# result can be encoded in it (e.g. not quartiles), otherwise None
+def binary_body(res):
+    if not accepts_binary():
+        return None
+    with phases.timed("serialization"):
+        return encode_timeseries(res)
+
+# the response with the binary body if there is one, otherwise JSON (streamed if stream is set)
+def serialize_response(res, stream, binary):
+    if binary is not None:
+        return app.response_class(binary, mimetype=TIMESERIES_MIMETYPE)
+    if stream:
+        return app.response_class(json_chunks(res), mimetype="application/json") # serialized while it's sent
+    with phases.timed("serialization"):
+        return jsonify(res)
+
 # generates the actual handler function that is configured in flask
-def generate_flask_handler(f):
+def generate_flask_handler(f, stream=False):
     def actual_handler():
-        res = f(request.args)
-        return jsonify(res)
+        return data_response(f(request.args), stream)
     return actual_handler
 
-def file_loader(filepath):
-    with open(filepath) as f:
-        return json.load(f)
-
+def data_response(res, stream):
+    version = res.get("version") if isinstance(res, dict) else None
+    binary = binary_body(res)
+    if version is None:
+        response = serialize_response(res, stream, binary)
+    else:
+        # versioned results (e.g. live snapshots) are revalidated by the browser with If-None-Match;
+        # the ETag is that of the format served, which is JSON when the result can't be encoded
+        etag = version + ("-binary" if binary is not None else "-json")
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = serialize_response(res, False, binary)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Accept")
+    return response
+
+# /metadata is built once and kept serialized and compressed; it's rebuilt when one of the
+# GeoJSON files changes (size or mtime); the ETag is the hash of the body, which also
+# contains the metadata configuration
 def configure_metadata_handler():
-    def metadata_handler(args):
+    filepaths = [cfg["metadata"]["locations"]["filepath"], cfg["metadata"]["parishes"]["filepath"]]
+    cached = {"stamps": None, "entry": (None, None)} # entry is (hash, bodies by content encoding)
+    lock = Lock()
+
+    def build():
+        contents = []
+        for filepath in filepaths:
+            with open(filepath, "rb") as f:
+                contents.append(f.read())
         res = {}
-        res["locations"] = file_loader(cfg["metadata"]["locations"]["filepath"])
-        res["parishes"] = file_loader(cfg["metadata"]["parishes"]["filepath"])
+        res["locations"] = json.loads(contents[0])
+        res["parishes"] = json.loads(contents[1])
         for x in cfg["metadata"]:
             if x != "locations" and x != "parishes":
                 res[x] = cfg["metadata"][x]
-        return res
-    handler = generate_flask_handler(metadata_handler)
-    handler = login_required(handler)
+        body = json.dumps(res, separators=(",", ":")).encode()
+        digest = hashlib.sha256(body).hexdigest()[:32] # of the body, which also depends on the configuration
+        if digest == cached["entry"][0]:
+            return
+        bodies = {"identity": body, "gzip": gzip.compress(body, 9)}
+        if brotli is not None:
+            bodies["br"] = brotli.compress(body)
+        cached["entry"] = (digest, bodies)
+        print(f"metadata rebuilt: {len(body)} bytes, {len(bodies['gzip'])} gzipped", file=sys.stderr)
+
+    def refresh():
+        stamps = [(s.st_mtime_ns, s.st_size) for s in map(stat, filepaths)]
+        if stamps != cached["stamps"]:
+            with lock:
+                if stamps != cached["stamps"]:
+                    build()
+                    cached["stamps"] = stamps
+
+    def metadata_handler():
+        refresh()
+        digest, bodies = cached["entry"] # read once, a concurrent rebuild replaces the whole entry
+        encoding = request.accept_encodings.best_match([e for e in ("br", "gzip") if e in bodies], default="identity")
+        etag = digest + ("" if encoding == "identity" else "-" + encoding)
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = app.response_class(bodies[encoding], mimetype="application/json")
+            if encoding != "identity":
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        response.vary.add("Accept-Encoding")
+        return response
+    handler = instrument(login_required(metadata_handler), "metadata", "metadata")
     app.add_url_rule("/metadata", view_func=handler)
 
+STREAM_KEEPALIVE_SECONDS = 15
+LONG_POLL_TIMEOUT_SECONDS = 30
+
+# configures /<name>/stream, which pushes each new frame of a connector that supports
+# subscriptions, as server-sent events or, with ?longpoll=1, as a single long-polled response
+def configure_stream_handler(subscribe, name, derived_metrics):
+    def frame_handler(frame):
+        return add_derived_metrics(frame, derived_metrics)
+    def stream_handler():
+        last_version = request.args.get("version", type=int) or request.headers.get("Last-Event-ID", type=int)
+        if request.args.get("longpoll"):
+            frame, version = subscribe(last_version, LONG_POLL_TIMEOUT_SECONDS)
+            if frame is None:
+                return app.response_class(status=204)
+            return jsonify(dict(frame_handler(frame), stream_version=version)) # the frame is shared between subscribers
+        def events():
+            version = last_version
+            while True:
+                frame, version = subscribe(version, STREAM_KEEPALIVE_SECONDS)
+                if frame is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield "id: {}\ndata: {}\n\n".format(version, json.dumps(frame_handler(frame)))
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # X-Accel-Buffering: don't let nginx buffer the events
+        return app.response_class(stream_with_context(events()), mimetype="text/event-stream", headers=headers)
+    handler = login_required(stream_handler)
+    handler.__name__ = handler.__name__ + "_" + name
+    app.add_url_rule('/' + name + '/stream', view_func=handler)
+
+# endpoints whose responses depend only on the request arguments, so that identical
+# concurrent requests can share one computation (prediction keeps per-client state)
+COALESCED_ENDPOINTS = ("history", "live")
+
+# connector handlers and options of the data endpoints, from which the ASGI serving mode
+# (see asgi.py) builds its own handlers
+data_endpoints = {}
+
 def configure_handler(module, name, parameters):
-    handler = module.generate_handler(parameters)
-    derived_metrics = cfg[name].get("derived_metrics")
-    if derived_metrics:
-        handler = derived_metrics_handler(handler, derived_metrics)
-    handler = time_endpoint(handler)
-    handler = generate_flask_handler(handler)
+    connector_handler = handler = module.generate_handler(parameters)
+    derived_metrics = compile_derived_metrics(cfg[name].get("derived_metrics") or {})
+    subscribe = getattr(handler, "subscribe", None)
+    if subscribe:
+        configure_stream_handler(subscribe, name, derived_metrics)
+    push_down = getattr(handler, "push_down", None)
+    pushed_down = push_down(derived_metrics) if push_down else frozenset()
+    handler = derived_metrics_handler(handler, derived_metrics, pushed_down)
+    if name in COALESCED_ENDPOINTS:
+        handler = coalesce(handler, name)
+    handler = generate_flask_handler(handler, cfg[name].get("stream_response", False))
+    handler = profiled(handler, name)
     handler = login_required(handler)
+    connector = module.__name__.split(".")[-1]
+    handler = instrument(handler, name, connector)
     handler.__name__ = handler.__name__ + "_" + name # flask requires handler functions to have unique names
     app.add_url_rule('/' + name, view_func=handler)
+    data_endpoints[name] = {"handler": connector_handler, "derived_metrics": derived_metrics, "pushed_down": pushed_down, "stream": cfg[name].get("stream_response", False), "connector": connector}
 
 modules = {"live": live, "history": history, "prediction": prediction, "prediction_evaluation": prediction_evaluation}
 
@@ -0,0 +1,47 @@
+# Compares the result assembly engine with the previous per-record
+# sorted().index() implementation on synthetic Flux records.
+# Run from the repository root: python -m backend.benchmarks.assembly_benchmark
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+from types import SimpleNamespace
+from ..connectors.common.assembly import assemble
+from ..connectors.common.utils import array_put_at, array_pad
+
+def fake_records(n_records, n_metrics=4, n_locations=50):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    n_timestamps = max(1, n_records // (n_metrics * n_locations))
+    records = []
+    for metric in range(n_metrics):
+        for location in range(n_locations):
+            for i in range(n_timestamps):
+                values = {"_time": start + timedelta(hours=i), "_field": "C" + str(metric), "_measurement": str(location), "_value": float(i)}
+                records.append(SimpleNamespace(values=values))
+    return records
+
+def legacy_assemble(records, location_variable, metric_variable):
+    timestamps = set()
+    values = {}
+    for record in records:
+        timestamp = record.values["_time"].isoformat().replace("+00:00", "Z")
+        timestamps.add(timestamp)
+        index = sorted(timestamps).index(timestamp)
+        metric_obj = values.setdefault(record.values[metric_variable], {})
+        arr = metric_obj.setdefault(record.values[location_variable], [])
+        array_put_at(arr, index, record.values["_value"])
+    for metric in values:
+        for location in values[metric]:
+            array_pad(values[metric][location], len(timestamps))
+    return {"timestamps": sorted(timestamps), "values": values}
+
+def timed(f, *args):
+    start_time = perf_counter()
+    res = f(*args)
+    return perf_counter() - start_time, res
+
+if __name__ == "__main__":
+    for n_records in (10000, 100000):
+        records = fake_records(n_records)
+        legacy_time, legacy_res = timed(legacy_assemble, records, "_measurement", "_field")
+        new_time, new_res = timed(assemble, records, "_measurement", "_field")
+        assert legacy_res == new_res
+        print("{} records: legacy {:.3f}s, assemble {:.3f}s, speedup {:.1f}x".format(n_records, legacy_time, new_time, legacy_time / new_time))
@@ -0,0 +1,49 @@
+# Compares the previous regex location filter with the location filter compiler
+# for 10, 100 and 1000 selected locations. Prints the size of the generated Flux
+# and, if a config file is given, the query times of its "history" connector for the
+# first locations in its metadata locations file.
+# Run from the repository root:
+#   python -m backend.benchmarks.location_filter_benchmark [config.yml start end every]
+import sys
+import json
+from time import perf_counter
+import yaml
+from yaml.loader import SafeLoader
+from ..connectors.common import influxdb
+
+def regex_filter_str(locations, location_variable):
+    locations_regex = '|'.join(map(lambda l: "^" + str(l) + "$", locations))
+    return '|> filter(fn: (r) => r["' + location_variable + '"] =~ /' + locations_regex + '/)'
+
+def timed_query(parameters, start, end, every, locations):
+    start_time = perf_counter()
+    influxdb.query(parameters["url"], parameters["token"], parameters["org"], parameters["bucket"], start, end,
+        parameters["location_variable"], parameters.get("metric_variable"), every, locations, parameters.get("filters"))
+    return perf_counter() - start_time
+
+if __name__ == "__main__":
+    parameters = None
+    location_ids = [str(i) for i in range(1000)]
+    if len(sys.argv) == 5:
+        with open(sys.argv[1], encoding="utf-8") as f:
+            cfg = yaml.load(f.read(), Loader=SafeLoader)
+        parameters = cfg["history"]
+        with open(cfg["metadata"]["locations"]["filepath"], encoding="utf-8") as f:
+            location_ids = [str(feature["properties"]["id"]) for feature in json.load(f)]
+        start, end, every = sys.argv[2:]
+    for n in (10, 100, 1000):
+        locations = location_ids[:n]
+        regex_size = len(regex_filter_str(locations, "_measurement"))
+        compiled_size = len(influxdb.location_filter_str(locations[:influxdb.LOCATION_PARTITION_SIZE], "_measurement"))
+        partitions = -(-n // influxdb.LOCATION_PARTITION_SIZE)
+        print("{} locations: regex filter {} chars; compiled filter {} chars per query, {} partition(s)".format(n, regex_size, compiled_size, partitions))
+        if parameters:
+            original_filter_str = influxdb.location_filter_str
+            influxdb.location_filter_str = regex_filter_str
+            partition_size = influxdb.LOCATION_PARTITION_SIZE
+            influxdb.LOCATION_PARTITION_SIZE = n
+            regex_time = timed_query(parameters, start, end, every, locations)
+            influxdb.location_filter_str = original_filter_str
+            influxdb.LOCATION_PARTITION_SIZE = partition_size
+            compiled_time = timed_query(parameters, start, end, every, locations)
+            print("    query time: regex {:.3f}s, compiled {:.3f}s".format(regex_time, compiled_time))
@@ -0,0 +1,43 @@
+# Builds the {"timestamps": [...], "values": {...}} response from Flux records.
+# Records are read once to collect the distinct timestamps, then a single
+# timestamp -> column index is built and each value is written into an array
+# preallocated with the final number of timestamps.
+
+def time_to_string(dt):
+    return dt.isoformat().replace("+00:00", "Z")
+
+# records: any iterable of FluxRecord, e.g. query_api.query_stream(), so that
+# records are collected while the response is still being received
+def collect_rows(records, location_variable, metric_variable=None):
+    rows = []
+    times = set()
+    for record in records:
+        values = record.values
+        time = values["_time"]
+        times.add(time)
+        metric = values[metric_variable] if metric_variable else None
+        rows.append((time, metric, values[location_variable], values["_value"]))
+    return rows, times
+
+def assemble(records, location_variable, metric_variable=None):
+    rows, times = collect_rows(records, location_variable, metric_variable)
+    sorted_times = sorted(times)
+    index = {time: i for i, time in enumerate(sorted_times)}
+    length = len(sorted_times)
+    values = {}
+    arrays = {} # maps (metric, location) to its preallocated array
+    for time, metric, location, value in rows:
+        key = (metric, location)
+        arr = arrays.get(key)
+        if arr is None:
+            arr = [None] * length
+            arrays[key] = arr
+            if metric_variable:
+                if metric not in values:
+                    assert metric != "None" and metric != "Density" # reserved metric names for frontend
+                    values[metric] = {}
+                values[metric][location] = arr
+            else:
+                values[location] = arr
+        arr[index[time]] = value
+    return {"timestamps": [time_to_string(time) for time in sorted_times], "values": values}
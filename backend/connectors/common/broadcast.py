@@ -0,0 +1,26 @@
+# Publishes the latest frame of a connector (e.g. a new live snapshot) to any
+# number of waiting subscribers. Subscribers block on a shared condition instead
+# of polling, so no work is done per subscriber until a new frame is published.
+from threading import Condition
+
+class Broadcast:
+
+    def __init__(self):
+        self.condition = Condition()
+        self.frame = None
+        self.version = 0 # incremented on each publish
+
+    def publish(self, frame):
+        with self.condition:
+            self.frame = frame
+            self.version += 1
+            self.condition.notify_all()
+
+    # blocks until there is a frame with a version other than the given one, or until
+    # timeout (seconds) expires; returns (frame, version), with frame None on timeout
+    def wait(self, version, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame is not None and self.version != version, timeout)
+            if self.frame is None or self.version == version:
+                return None, version
+            return self.frame, self.version
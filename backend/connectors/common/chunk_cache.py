@@ -0,0 +1,115 @@
+# Cache of history results split in time chunks aligned to the epoch, so that
+# overlapping requests (e.g. when scrubbing the time slider) only query the
+# chunks that were not fetched before.
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+from time import monotonic
+from .data import merge_results, slice_result
+from .utils import dt_to_string, align
+
+# LRU cache bounded by the estimated size of the stored results
+class ChunkCache:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # maps key to (result, size, expiration)
+        self.size = 0
+        self.lock = Lock()
+        self.hits = 0 # chunk lookups, exposed as a metric
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            res, _, expiration = entry
+            if expiration is not None and expiration < monotonic():
+                self.remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return res
+
+    # ttl in seconds; None means the entry is kept until evicted
+    def put(self, key, res, ttl=None):
+        size = result_size(res)
+        if size > self.max_bytes:
+            return
+        expiration = monotonic() + ttl if ttl is not None else None
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (res, size, expiration)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+
+    # pre: lock is held
+    def remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+# rough estimate of the memory used by a result
+def result_size(res):
+    return 64 * len(res["timestamps"]) + values_size(res["values"])
+
+def values_size(values):
+    size = 0
+    for key, value in values.items():
+        size += 64 + (values_size(value) if isinstance(value, dict) else 8 * len(value))
+    return size
+
+# chunk duration: smallest multiple of every that is at least min_chunk
+def chunk_duration(every, min_chunk):
+    if not every:
+        return min_chunk
+    return -(-min_chunk // every) * every
+
+# query_range(start_dt, end_dt) runs the actual query for [start_dt, end_dt).
+# Aggregated results are labeled with the end of each window, so a chunk
+# [c, c + chunk) holds the timestamps c < t <= c + chunk; raw results hold c <= t < c + chunk.
+def chunked_query(cache, key_prefix, query_range, start_dt, end_dt, every, min_chunk, open_chunk_ttl):
+    chunk = chunk_duration(every, min_chunk)
+    aggregated = every is not None
+    now = datetime.utcnow()
+    chunk_starts = []
+    chunk_start = align(start_dt, chunk)
+    while chunk_start < end_dt:
+        chunk_starts.append(chunk_start)
+        chunk_start += chunk
+
+    chunks = {}
+    missing = []
+    for chunk_start in chunk_starts:
+        res = cache.get(key_prefix + (chunk_start,))
+        if res is None:
+            missing.append(chunk_start)
+        else:
+            chunks[chunk_start] = res
+
+    # consecutive missing chunks are fetched with a single query
+    for run in consecutive_runs(missing, chunk):
+        run_end = run[-1] + chunk
+        res = query_range(run[0], run_end)
+        for chunk_start in run:
+            first, last = dt_to_string(chunk_start), dt_to_string(chunk_start + chunk)
+            chunk_res = slice_result(res, first, last, include_last=aggregated)
+            ttl = open_chunk_ttl if chunk_start + chunk > now else None
+            cache.put(key_prefix + (chunk_start,), chunk_res, ttl)
+            chunks[chunk_start] = chunk_res
+
+    res = merge_results([chunks[chunk_start] for chunk_start in chunk_starts])
+    return slice_result(res, dt_to_string(start_dt), dt_to_string(end_dt), include_last=aggregated)
+
+def consecutive_runs(chunk_starts, chunk):
+    runs = []
+    for chunk_start in chunk_starts:
+        if runs and runs[-1][-1] + chunk == chunk_start:
+            runs[-1].append(chunk_start)
+        else:
+            runs.append([chunk_start])
+    return runs
@@ -1 +1,46 @@
+from bisect import bisect_left, bisect_right
+
 empty_response = {"timestamps": [], "values": {}}
+
+# merges results that cover disjoint time ranges and/or disjoint locations;
+# always returns new arrays, so the given results are left untouched
+def merge_results(results):
+    timestamps = sorted(set(t for res in results for t in res["timestamps"]))
+    index = {t: i for i, t in enumerate(timestamps)}
+    values = {}
+    for res in results:
+        positions = [index[t] for t in res["timestamps"]]
+        merge_values(values, res["values"], positions, len(timestamps))
+    return {"timestamps": timestamps, "values": values}
+
+def merge_values(target, source, positions, length):
+    contiguous = len(positions) > 0 and positions[-1] - positions[0] == len(positions) - 1
+    for key, value in source.items():
+        if isinstance(value, dict): # metric -> locations
+            merge_values(target.setdefault(key, {}), value, positions, length)
+            continue
+        arr = target.get(key)
+        if arr is None:
+            arr = [None] * length
+            target[key] = arr
+        if contiguous:
+            arr[positions[0]:positions[-1] + 1] = value
+        else:
+            for position, v in zip(positions, value):
+                arr[position] = v
+
+# returns the part of a result whose timestamps t are first <= t < last
+# (or first < t <= last when include_last is set); last=None means no upper bound
+def slice_result(res, first, last=None, include_last=False):
+    timestamps = res["timestamps"]
+    if include_last:
+        i, j = bisect_right(timestamps, first), bisect_right(timestamps, last) if last else len(timestamps)
+    else:
+        i, j = bisect_left(timestamps, first), bisect_left(timestamps, last) if last else len(timestamps)
+    return {"timestamps": timestamps[i:j], "values": slice_values(res["values"], i, j)}
+
+def slice_values(values, i, j):
+    res = {}
+    for key, value in values.items():
+        res[key] = slice_values(value, i, j) if isinstance(value, dict) else value[i:j]
+    return res
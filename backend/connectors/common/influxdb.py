@@ -1,18 +1,88 @@
-import influxdb_client
-from time import perf_counter
-from .utils import array_put_at, array_pad
-import sys
+from .influxdb_clients import get_client
+from . import phases
+from .assembly import assemble, time_to_string
+from .data import merge_results
+from .parallel import LazyThreadPool
+from .utils import parse_duration, is_aligned, align
+from datetime import datetime, timezone
 
-def query_range_str(bucket, start, end, every, locations, location_variable, filters):
+# location sets up to this size are filtered with tag equality, larger ones with contains()
+LOCATION_EQUALITY_MAX_SIZE = 10
+# location sets larger than this are split into partitions of this size, queried in parallel
+LOCATION_PARTITION_SIZE = 250
+partitions_pool = LazyThreadPool(max_workers=4)
+
+def flux_string(s):
+    return '"' + str(s).replace('\\', '\\\\').replace('"', '\\"').replace('${', '\\${') + '"'
+
+# condition selecting the rows whose column is one of the given values
+def column_in_str(values, variable):
+    column = 'r[' + flux_string(variable) + ']'
+    values = [flux_string(v) for v in values]
+    if len(values) <= LOCATION_EQUALITY_MAX_SIZE:
+        return ' or '.join(column + ' == ' + v for v in values)
+    return 'contains(value: ' + column + ', set: [' + ', '.join(values) + '])'
+
+def location_filter_str(locations, location_variable):
+    return '|> filter(fn: (r) => ' + column_in_str(locations, location_variable) + ')'
+
+# filters (as in the connectors' "filters" parameter) restricted to the requested metrics, if any
+def metric_filters(filters, metrics, metric_variable):
+    if not metrics or not metric_variable:
+        return filters
+    return (filters or []) + ['(r) => ' + column_in_str(metrics, metric_variable)]
+
+# Rollup buckets hold the mean of the raw bucket's values over each `every` interval,
+# labeled with the end of the interval (as written by aggregateWindow in a downsampling task).
+# Given as [{"bucket": ..., "every": ..., "offset": ...}] in the connector parameters, where offset is
+# the delay after the end of an interval until its point is written (the task's offset, 0m by default);
+# returns them coarsest first.
+def parse_rollups(rollups):
+    res = [(rollup["bucket"], rollup["every"], parse_duration(rollup["every"]), parse_duration(rollup.get("offset", "0m"))) for rollup in rollups or []]
+    return sorted(res, key=lambda rollup: rollup[2], reverse=True)
+
+def parse_time(s):
+    return datetime.fromisoformat(s.replace("Z", "+00:00"))
+
+# picks the coarsest rollup whose interval divides every and to which the range bounds are aligned,
+# so that each requested window is the mean of whole rollup intervals; returns the bucket, the range
+# bounds and the rollup interval by which the rollup's labels must be shifted back (None for the raw bucket).
+# Ranges without an end, or ending after the last interval already written to the rollup, are
+# queried from the raw bucket, since the rollup doesn't have the still open interval yet.
+def select_bucket(bucket, rollups, start, end, every, now=None):
+    if not rollups or not every or not end:
+        return bucket, start, end, None
+    try:
+        every_td = parse_duration(every)
+        start_dt = parse_time(start)
+        end_dt = parse_time(end)
+    except (ValueError, AssertionError): # e.g. relative range or "1mo" interval
+        return bucket, start, end, None
+    now = now or datetime.now(timezone.utc)
+    if end_dt.tzinfo is None:
+        now = now.astimezone(timezone.utc).replace(tzinfo=None)
+    for rollup_bucket, rollup_every, rollup_td, rollup_offset in rollups:
+        if every_td % rollup_td or not is_aligned(start_dt, rollup_td) or not is_aligned(end_dt, rollup_td):
+            continue
+        if end_dt > align(now - rollup_offset, rollup_td): # end of the last complete interval
+            continue
+        # the rollup point labeled t holds the values in [t - rollup_every, t)
+        rollup_start = (start_dt + rollup_td).isoformat()
+        rollup_end = (end_dt + rollup_td).isoformat()
+        return rollup_bucket, rollup_start, rollup_end, rollup_every
+    return bucket, start, end, None
+
+def query_range_str(bucket, start, end, every, locations, location_variable, filters, shift=None):
     # TODO usar bind parameters em vez de espetar os params diretamente na query string
     res = 'from(bucket: "' + bucket + '")\
         |> range(start: ' + start + (', stop: ' + end if end else '') + ')'
+    if shift:
+        res += '|> timeShift(duration: -' + shift + ')'
     if filters:
         for filter in filters:
             res += '|> filter(fn: ' + filter + ')'
     if locations:
-        locations_regex = '|'.join(map(lambda l: "^" + str(l) + "$", locations))
-        res += '|> filter(fn: (r) => r["' + location_variable + '"] =~ /' + locations_regex + '/)'
+        res += location_filter_str(locations, location_variable)
     if every:
         res += '|> aggregateWindow(every: ' + every + ', fn: mean, createEmpty: false)'
     return res
@@ -25,62 +95,85 @@ def query_last_str(bucket, start, locations, location_variable, filters):
         for filter in filters:
             res += '|> filter(fn: ' + filter + ')'
     if locations:
-        locations_regex = '|'.join(map(lambda l: "^" + str(l) + "$", locations))
-        res += '|> filter(fn: (r) => r["' + location_variable + '"] =~ /' + locations_regex + '/)'
+        res += location_filter_str(locations, location_variable)
     res += '|> keep(columns: ["_time"]) |> sort(columns: ["_time"]) |> last(column: "_time")'
     return res
 
-def put_value(values, record, metric_variable, location_variable, index):
-    location_id = record.values[location_variable]
-    value = record.values["_value"]
+# translates a compiled derived metric (see parse_derived_metrics) into a Flux expression over
+# the pivoted row r, or returns None if InfluxDB wouldn't give the same result: a division whose
+# divisor contains a division (x / inf is 0 there, while a division by zero is null in python)
+# or a non-finite constant. Non-finite results are made null after the query.
+def derived_flux_expression(plan, name):
+    def translate(index):
+        operation, argument = plan.steps[index]
+        if operation == "metric":
+            return 'r[' + flux_string(argument) + ']'
+        if operation == "constant":
+            literal = repr(argument)
+            return '(' + literal + ')' if argument == argument and "." in literal and "e" not in literal else None
+        if operation == "finite":
+            return translate(argument[0])
+        if operation == "/" and has_division(argument[1]):
+            return None
+        left, right = translate(argument[0]), translate(argument[1])
+        return '(' + left + ' ' + operation + ' ' + right + ')' if left and right else None
+    def has_division(index):
+        operation, argument = plan.steps[index]
+        return operation == "/" or (operation in ("+", "-", "*", "finite") and any(has_division(i) for i in argument))
+    index, base_metrics = plan.outputs[name]
+    return translate(index) if base_metrics else None
+
+# wraps a range query so that InfluxDB also computes derived metrics next to the data: the rows are
+# pivoted to one column per metric and each derived metric is a map over them. derived is
+# (base metrics returned as they are, [(derived metric, Flux expression)])
+def derived_query_str(query_str, derived, location_variable, metric_variable):
+    base_metrics, expressions = derived
+    location_column = flux_string(location_variable)
+    metric_column = flux_string(metric_variable)
+    res = 'data = ' + query_str + '\n'
+    tables = []
+    if base_metrics:
+        res += 'base = data |> filter(fn: (r) => ' + column_in_str(base_metrics, metric_variable) + ')\
+            |> keep(columns: ["_time", "_value", ' + location_column + ', ' + metric_column + '])\n'
+        tables.append('base')
+    res += 'pivoted = data |> group(columns: [' + location_column + '])\
+        |> pivot(rowKey: ["_time"], columnKey: [' + metric_column + '], valueColumn: "_value")\n'
+    for i, (name, expression) in enumerate(expressions):
+        res += 'derived' + str(i) + ' = pivoted\
+            |> map(fn: (r) => ({_time: r._time, _value: ' + expression + ', ' + location_column + ': r[' + location_column + '], ' + metric_column + ': ' + flux_string(name) + '}))\
+            |> filter(fn: (r) => exists r._value)\n'
+        tables.append('derived' + str(i))
+    res += 'union(tables: [' + ', '.join(tables) + ']) |> group(columns: [' + location_column + ', ' + metric_column + '])'
+    return res
 
-    if metric_variable:
-        metric = record.values[metric_variable]
-        if metric not in values:
-            assert metric != "None" and metric != "Density" # reserved metric names for frontend
-            values[metric] = {}
-        metric_obj = values[metric]
-        if location_id not in metric_obj:
-            metric_obj[location_id] = []
-        array_put_at(metric_obj[location_id], index, value)
-    else:
-        if location_id not in values:
-            values[location_id] = []
-        array_put_at(values[location_id], index, value)
+# runs query_locations(partition) for each partition of a large location set, concurrently,
+# and merges the results; returns None if the set is small enough for a single query
+def query_partitioned(locations, query_locations):
+    if not locations or len(locations) <= LOCATION_PARTITION_SIZE:
+        return None
+    partitions = [locations[i:i + LOCATION_PARTITION_SIZE] for i in range(0, len(locations), LOCATION_PARTITION_SIZE)]
+    return merge_results(partitions_pool.map(query_locations, partitions))
 
-def query(url, token, org, bucket, start, end, location_variable, metric_variable=None, every=None, locations=[], filters=[]):
-    with influxdb_client.InfluxDBClient(url=url, token=token, org=org, debug=False) as client:
-        query_api = client.query_api()
-        query_str = query_range_str(bucket, start, end, every, locations, location_variable, filters)
-        start_time = perf_counter()
-        tables = query_api.query(query_str)
-        end_time = perf_counter()
-        print("query time: {}".format(end_time - start_time), file=sys.stderr)
-        timestamps = set()
-        values = {}
-        for table in tables:
-            for record in table.records:
-                timestamp = record.values["_time"].isoformat().replace("+00:00", "Z")
-                timestamps.add(timestamp)
-                index = sorted(timestamps).index(timestamp)
-                put_value(values, record, metric_variable, location_variable, index)
-    pad_values(values, len(timestamps))
-    return {"timestamps": sorted(timestamps), "values": values}
+def query(url, token, org, bucket, start, end, location_variable, metric_variable=None, every=None, locations=[], filters=[], rollups=None, derived=None):
+    res = query_partitioned(locations, lambda partition: query(url, token, org, bucket, start, end, location_variable, metric_variable, every, partition, filters, rollups, derived))
+    if res is not None:
+        return res
+    query_api = get_client(url, token, org).query_api()
+    bucket, start, end, shift = select_bucket(bucket, rollups, start, end, every)
+    query_str = query_range_str(bucket, start, end, every, locations, location_variable, filters, shift)
+    if derived:
+        query_str = derived_query_str(query_str, derived, location_variable, metric_variable)
+    with phases.timed("query"):
+        records = query_api.query_stream(query_str)
+    with phases.consuming(records) as records:
+        return assemble(records, location_variable, metric_variable)
 
 def query_last_timestamp(url, token, org, bucket, start, location_variable, locations=[], filters=[]):
-    with influxdb_client.InfluxDBClient(url=url, token=token, org=org, debug=False) as client:
-        query_api = client.query_api()
-        query_str = query_last_str(bucket, start, locations, location_variable, filters)
-        start_time = perf_counter()
+    query_api = get_client(url, token, org).query_api()
+    query_str = query_last_str(bucket, start, locations, location_variable, filters)
+    with phases.timed("query"):
         tables = query_api.query(query_str)
-        end_time = perf_counter()
-        print("query time: {}".format(end_time - start_time), file=sys.stderr)
-        for table in tables:
-            for record in table.records:
-                return record.values["_time"].isoformat().replace("+00:00", "Z")
+    for table in tables:
+        for record in table.records:
+            return time_to_string(record.values["_time"])
     raise Exception("No data in range")
-
-def pad_values(values, length):
-    for metric_name in values:
-        for location in values[metric_name]:
-            array_pad(values[metric_name][location], length)
@@ -0,0 +1,33 @@
+# Asynchronous counterparts of influxdb.query and influxdb.query_last_timestamp, used by the
+# connectors' async handlers in the ASGI serving mode (see asgi.py). Requires aiohttp and aiocsv.
+import asyncio
+from .influxdb_clients import get_async_client
+from .influxdb import query_range_str, query_last_str, derived_query_str, select_bucket, LOCATION_PARTITION_SIZE
+from .assembly import assemble, time_to_string
+from .data import merge_results
+from . import phases
+
+async def query(url, token, org, bucket, start, end, location_variable, metric_variable=None, every=None, locations=[], filters=[], rollups=None, derived=None):
+    if locations and len(locations) > LOCATION_PARTITION_SIZE:
+        partitions = [locations[i:i + LOCATION_PARTITION_SIZE] for i in range(0, len(locations), LOCATION_PARTITION_SIZE)]
+        results = await asyncio.gather(*(query(url, token, org, bucket, start, end, location_variable, metric_variable, every, partition, filters, rollups, derived) for partition in partitions))
+        return merge_results(results)
+    query_api = get_async_client(url, token, org).query_api()
+    bucket, start, end, shift = select_bucket(bucket, rollups, start, end, every)
+    query_str = query_range_str(bucket, start, end, every, locations, location_variable, filters, shift)
+    if derived:
+        query_str = derived_query_str(query_str, derived, location_variable, metric_variable)
+    with phases.timed("query"):
+        records = [record async for record in await query_api.query_stream(query_str)]
+    with phases.timed("assembly"):
+        return assemble(records, location_variable, metric_variable)
+
+async def query_last_timestamp(url, token, org, bucket, start, location_variable, locations=[], filters=[]):
+    query_api = get_async_client(url, token, org).query_api()
+    query_str = query_last_str(bucket, start, locations, location_variable, filters)
+    with phases.timed("query"):
+        tables = await query_api.query(query_str)
+    for table in tables:
+        for record in table.records:
+            return time_to_string(record.values["_time"])
+    raise Exception("No data in range")
@@ -0,0 +1,81 @@
+# Registry of long-lived InfluxDB clients shared by all connectors, so that
+# requests reuse keep-alive connections instead of opening a new client
+# (and a new TCP/TLS connection) for every query.
+import influxdb_client
+from threading import Lock
+import atexit
+import os
+
+# maps (url, org, token) to client
+clients = {}
+# maps (url, org, token) to keyword arguments used when the client is created
+clients_options = {}
+# maps (url, org, token) to asynchronous client, used by the ASGI serving mode (see asgi.py);
+# they are bound to the event loop that creates them, so only one loop may use them
+async_clients = {}
+clients_lock = Lock()
+
+# pool_size: number of keep-alive connections kept by the client
+# timeout: request timeout in milliseconds, or a (connect, read) pair
+def set_client_options(url, token, org, pool_size=None, timeout=None):
+    options = {}
+    if pool_size:
+        options["connection_pool_maxsize"] = pool_size
+    if timeout:
+        options["timeout"] = timeout
+    with clients_lock:
+        clients_options[(url, org, token)] = options
+
+def get_client(url, token, org):
+    key = (url, org, token)
+    with clients_lock:
+        client = clients.get(key)
+        if client is None:
+            options = clients_options.get(key, {})
+            client = influxdb_client.InfluxDBClient(url=url, token=token, org=org, debug=False, **options)
+            clients[key] = client
+        return client
+
+# the client's timeout covers the whole request, so a (connect, read) pair is added up
+def get_async_client(url, token, org):
+    key = (url, org, token)
+    client = async_clients.get(key)
+    if client is None:
+        from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync # requires aiohttp and aiocsv
+        options = dict(clients_options.get(key, {}))
+        if isinstance(options.get("timeout"), (tuple, list)):
+            options["timeout"] = sum(options["timeout"])
+        client = InfluxDBClientAsync(url=url, token=token, org=org, debug=False, **options)
+        async_clients[key] = client
+    return client
+
+async def close_async_clients():
+    for client in async_clients.values():
+        await client.close()
+    async_clients.clear()
+
+def close_clients():
+    with clients_lock:
+        for client in clients.values():
+            client.close()
+        clients.clear()
+
+# connections must not be shared between a parent process and its forked workers
+def forget_clients():
+    global clients_lock
+    clients.clear()
+    clients_lock = Lock()
+
+os.register_at_fork(after_in_child=forget_clients)
+atexit.register(close_clients)
+
+try:
+    import uwsgi
+    chained_atexit = getattr(uwsgi, "atexit", None)
+    def uwsgi_atexit(): # python's atexit is not called when a uWSGI worker is reloaded
+        close_clients()
+        if chained_atexit:
+            chained_atexit()
+    uwsgi.atexit = uwsgi_atexit
+except ImportError:
+    pass
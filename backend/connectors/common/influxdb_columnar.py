@@ -0,0 +1,82 @@
+# Columnar alternative to influxdb.query: reads the raw CSV response, pivots each
+# metric into a dense float64 (location x time) matrix with NaN for gaps and
+# builds the {"timestamps", "values"} response straight from the matrices.
+from influxdb_client import Dialect
+import numpy as np
+from .influxdb_clients import get_client
+from . import phases
+from .influxdb import query_range_str, derived_query_str, query_partitioned, select_bucket
+
+# no annotation rows, only a header row before each table with a new schema
+CSV_DIALECT = Dialect(header=True, annotations=[])
+
+def read_columns(rows, location_variable, metric_variable):
+    times = []
+    metrics = []
+    locations = []
+    values = []
+    header = None
+    for row in rows:
+        if len(row) < 3:
+            continue # empty line between tables
+        if row[1] == "result" and row[2] == "table":
+            header = row
+            time_col = header.index("_time")
+            value_col = header.index("_value")
+            location_col = header.index(location_variable)
+            metric_col = header.index(metric_variable) if metric_variable else None
+            continue
+        times.append(row[time_col][:-1]) # drop the "Z", numpy datetimes are naive
+        metrics.append(row[metric_col] if metric_variable else "")
+        locations.append(row[location_col])
+        value = row[value_col]
+        values.append(float(value) if value != "" else np.nan)
+    return times, metrics, locations, values
+
+# formatted as time_to_string formats the records' datetimes, which have microsecond precision:
+# with a fractional part only for the timestamps that have one
+def times_to_strings(times):
+    times = times.astype("datetime64[us]")
+    strings = np.datetime_as_string(times, unit="s").astype(object)
+    fractional = times.astype("int64") % 10**6 != 0
+    if fractional.any():
+        strings[fractional] = np.datetime_as_string(times[fractional], unit="us")
+    return [t + "Z" for t in strings.tolist()]
+
+def matrix_to_lists(matrix):
+    cells = matrix.astype(object)
+    cells[np.isnan(matrix)] = None
+    return cells.tolist()
+
+def pivot(times, metrics, locations, values, metric_variable):
+    sorted_times, time_index = np.unique(np.array(times, dtype="datetime64[ns]"), return_inverse=True)
+    metric_names, metric_index = np.unique(np.array(metrics), return_inverse=True)
+    location_ids, location_index = np.unique(np.array(locations), return_inverse=True)
+    values = np.array(values, dtype=np.float64)
+    res = {}
+    for i, metric in enumerate(metric_names.tolist()):
+        in_metric = metric_index == i
+        rows, row_index = np.unique(location_index[in_metric], return_inverse=True)
+        matrix = np.full((len(rows), len(sorted_times)), np.nan)
+        matrix[row_index, time_index[in_metric]] = values[in_metric]
+        res[metric] = dict(zip(location_ids[rows].tolist(), matrix_to_lists(matrix)))
+    if not metric_variable:
+        res = res.get("", {})
+    else:
+        assert "None" not in res and "Density" not in res # reserved metric names for frontend
+    return {"timestamps": times_to_strings(sorted_times), "values": res}
+
+def query(url, token, org, bucket, start, end, location_variable, metric_variable=None, every=None, locations=[], filters=[], rollups=None, derived=None):
+    res = query_partitioned(locations, lambda partition: query(url, token, org, bucket, start, end, location_variable, metric_variable, every, partition, filters, rollups, derived))
+    if res is not None:
+        return res
+    query_api = get_client(url, token, org).query_api()
+    bucket, start, end, shift = select_bucket(bucket, rollups, start, end, every)
+    query_str = query_range_str(bucket, start, end, every, locations, location_variable, filters, shift)
+    if derived:
+        query_str = derived_query_str(query_str, derived, location_variable, metric_variable)
+    with phases.timed("query"):
+        rows = query_api.query_csv(query_str, dialect=CSV_DIALECT)
+    with phases.consuming(rows) as rows:
+        columns = read_columns(rows, location_variable, metric_variable)
+        return pivot(*columns, metric_variable)
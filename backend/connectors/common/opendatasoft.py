@@ -1,6 +1,7 @@
 from urllib.request import urlopen
 import json
 from .utils import array_put_at, array_pad
+from . import phases
 
 def fetch_records(url):
     next_url = url
@@ -15,8 +16,40 @@ def get_next_url(res):
         if link["rel"] == "next":
             return link["href"]
 
+# aiohttp session of the ASGI serving mode (see asgi.py), created on first use in its event loop
+async_session = {"session": None}
+
+async def fetch_records_async(url):
+    if async_session["session"] is None:
+        import aiohttp # only required by the ASGI serving mode
+        async_session["session"] = aiohttp.ClientSession()
+    records = []
+    next_url = url
+    while next_url:
+        async with async_session["session"].get(next_url) as response:
+            res = json.loads(await response.read())
+        records.extend(element["record"] for element in res["records"])
+        next_url = get_next_url(res)
+    return records
+
+async def close_async_session():
+    if async_session["session"] is not None:
+        await async_session["session"].close()
+        async_session["session"] = None
+
 def query(url_prefix, dataset, first_timestamp, last_timestamp, max_record_timestamp, timestamp_field, location_field, metric_fields):
     url = generate_url(url_prefix, dataset, timestamp_field, first_timestamp, last_timestamp)
+    with phases.consuming(fetch_records(url)) as records:
+        return build_result(records, max_record_timestamp, timestamp_field, location_field, metric_fields)
+
+async def query_async(url_prefix, dataset, first_timestamp, last_timestamp, max_record_timestamp, timestamp_field, location_field, metric_fields):
+    url = generate_url(url_prefix, dataset, timestamp_field, first_timestamp, last_timestamp)
+    with phases.timed("query"):
+        records = await fetch_records_async(url)
+    with phases.timed("assembly"):
+        return build_result(records, max_record_timestamp, timestamp_field, location_field, metric_fields)
+
+def build_result(records, max_record_timestamp, timestamp_field, location_field, metric_fields):
     timestamps = set()
     values = {}
     for metric_name in metric_fields:
@@ -24,7 +57,7 @@ def query(url_prefix, dataset, first_timestamp, last_timestamp, max_record_times
     current_timestamp = "1900-01-01T00:00:00Z"
     current_timestamp_index = -1
     new_max_record_timestamp = max_record_timestamp if max_record_timestamp else current_timestamp
-    for record in fetch_records(url):
+    for record in records:
         record_timestamp = record["timestamp"]
         if max_record_timestamp and record_timestamp <= max_record_timestamp:
             continue # record was processed in a previous invocation
@@ -0,0 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+import os
+
+# Thread pool created on first use, so that its threads belong to the process that
+# uses it (e.g. a forked uWSGI worker) and not to the process that imported it.
+class LazyThreadPool:
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.executor = None
+        os.register_at_fork(after_in_child=self.forget)
+
+    def forget(self):
+        self.executor = None
+
+    # like map(f, items), with the calls running concurrently, each in a copy of the
+    # caller's context (so that e.g. the request's phases are recorded)
+    def map(self, f, items):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        context = copy_context()
+        return list(self.executor.map(lambda item: context.copy().run(f, item), items))
@@ -0,0 +1,62 @@
+# Per-request timing of the phases of a request (auth, query, assembly, derived_metrics,
+# serialization, send). The backend sets an accumulator for each instrumented request;
+# code running outside of one (e.g. background refreshes) records nothing.
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+
+class RequestPhases:
+
+    def __init__(self):
+        self.durations = {} # phase -> seconds, summed over concurrent sub-queries
+        self.lock = Lock()
+
+    def add(self, phase, seconds):
+        with self.lock:
+            self.durations[phase] = self.durations.get(phase, 0) + seconds
+
+current = ContextVar("request_phases", default=None)
+
+def record(phase, seconds):
+    request_phases = current.get()
+    if request_phases is not None:
+        request_phases.add(phase, seconds)
+
+@contextmanager
+def timed(phase):
+    start_time = perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, perf_counter() - start_time)
+
+class WaitedIterable:
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self.waited = 0
+
+    def __iter__(self):
+        iterator = iter(self.iterable)
+        while True:
+            start_time = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.waited += perf_counter() - start_time
+            yield item
+
+# for blocks that build a result while an upstream response is received: the time spent
+# waiting for the yielded iterable's items counts as "query", the rest of the block as "assembly"
+@contextmanager
+def consuming(iterable):
+    waited_iterable = WaitedIterable(iterable)
+    start_time = perf_counter()
+    try:
+        yield waited_iterable
+    finally:
+        record("query", waited_iterable.waited)
+        record("assembly", perf_counter() - start_time - waited_iterable.waited)
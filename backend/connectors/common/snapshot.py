@@ -0,0 +1,58 @@
+# In-process snapshot of a connector result, refreshed by a background thread so
+# that all clients are served from memory instead of each triggering a query.
+from threading import Thread, Lock
+from time import sleep
+from hashlib import sha1
+import json
+import sys
+from .broadcast import Broadcast
+
+class Snapshot:
+
+    def __init__(self, compute, refresh_interval):
+        self.compute = compute
+        self.refresh_interval = refresh_interval
+        self.res = None
+        self.version = None
+        self.thread = None
+        self.lock = Lock()
+        self.changes = Broadcast() # publishes each new (result, version)
+
+    # returns (result, version); the version only changes when the result does
+    def get(self):
+        if self.thread is None:
+            self.start() # started lazily, so that the thread runs in the (forked) worker process
+        if self.res is None:
+            with self.lock:
+                if self.res is None:
+                    self.refresh()
+        return self.res, self.version
+
+    # blocks until the snapshot changes from the one published with the given
+    # broadcast version (see Broadcast.wait)
+    def wait(self, version, timeout):
+        self.get()
+        return self.changes.wait(version, timeout)
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def refresh(self):
+        res = self.compute()
+        version = sha1(json.dumps(res).encode()).hexdigest()[:16]
+        if version != self.version:
+            self.res, self.version = res, version
+            self.changes.publish((res, version))
+            return True
+        return False
+
+    def run(self):
+        while True:
+            sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print("error refreshing snapshot: {}".format(e), file=sys.stderr)
@@ -1,4 +1,4 @@
-from datetime import timedelta, datetime
+from datetime import timedelta, datetime, timezone
 from uuid import uuid4
 
 # parses string in 'xu' format, where x is an int and u is one of (m, h, d, w)
@@ -28,6 +28,29 @@ def parse_date(datestr):
         datestr = splits[0] + "Z"
     return datetime.strptime(datestr, "%Y-%m-%dT%H:%M:%SZ")
 
+EPOCH = datetime(1970, 1, 1)
+
+# start of the `duration` interval (counted from the epoch, like Flux windows) that contains dt;
+# naive datetimes are taken as UTC
+def align(dt, duration):
+    epoch = EPOCH if dt.tzinfo is None else EPOCH.replace(tzinfo=timezone.utc)
+    return epoch + (dt - epoch) // duration * duration
+
+def is_aligned(dt, duration):
+    return align(dt, duration) == dt
+
+# splits [start_dt, end_dt) in up to n consecutive ranges whose inner bounds are aligned to `every`
+def split_range(start_dt, end_dt, every, n):
+    aligned_start = align(start_dt, every)
+    step = max(every, -(-(end_dt - aligned_start) // n // every) * every)
+    bounds = [start_dt]
+    bound = aligned_start + step
+    while bound < end_dt:
+        bounds.append(bound)
+        bound += step
+    bounds.append(end_dt)
+    return list(zip(bounds[:-1], bounds[1:]))
+
 def array_put_at(arr, index, value):
     if len(arr) > index:
         arr[index] = value
@@ -1,4 +1,19 @@
-from .common.influxdb import query
+from .common import influxdb, influxdb_async, phases
+from .common.influxdb_clients import set_client_options
+from .common.chunk_cache import ChunkCache, chunked_query
+from .common.data import merge_results
+from .common.parallel import LazyThreadPool
+from .common.utils import parse_duration, parse_date, dt_to_string, is_aligned, split_range
+from math import isfinite
+import asyncio
+
+# InfluxDB returns infinities (e.g. for divisions by zero) where derived metrics are null
+def null_non_finite(res, metrics):
+    for metric in metrics:
+        for location_values in res["values"].get(metric, {}).values():
+            for i, value in enumerate(location_values):
+                if value is not None and not isfinite(value):
+                    location_values[i] = None
 
 # "1,2" -> [1,2]
 def commas_to_list(s):
@@ -12,11 +27,105 @@ def generate_handler(parameters):
     metric_variable = parameters.get("metric_variable")
     location_variable = parameters["location_variable"]
     filters = parameters.get("filters")
-    def influxdb_history_handler(args):
-        start = args.get("start")
-        end = args.get("end")
+    rollups = influxdb.parse_rollups(parameters.get("rollups"))
+    set_client_options(url, token, org, parameters.get("pool_size"), parameters.get("timeout"))
+    engine = parameters.get("engine", "records")
+    assert engine in ("records", "columnar")
+    if engine == "columnar":
+        from .common import influxdb_columnar as query_module # requires numpy
+    else:
+        query_module = influxdb
+    cache_parameters = parameters.get("cache")
+    if cache_parameters:
+        cache = ChunkCache(cache_parameters.get("max_bytes", 256 * 1024 * 1024))
+        min_chunk = parse_duration(cache_parameters.get("chunk", "1d"))
+        open_chunk_ttl = cache_parameters.get("open_chunk_ttl", 60)
+    split_parameters = parameters.get("split")
+    if split_parameters:
+        split_threshold = parse_duration(split_parameters.get("threshold", "30d"))
+        split_pool = LazyThreadPool(split_parameters.get("max_workers", 4))
+    # derived metrics computed by InfluxDB, if enabled (see push_down)
+    pushdown = parameters.get("derived_metrics_pushdown", False)
+    derived_metrics = {"plan": None, "expressions": {}}
+    def query_range(start, end, every, locations, query_filters, derived):
+        res = query_module.query(url, token, org, bucket, start, end, location_variable, metric_variable, every, locations, query_filters, rollups, derived)
+        if derived:
+            null_non_finite(res, [name for name, _ in derived[1]])
+        return res
+    # long ranges are split in sub-ranges aligned to every, queried concurrently and merged in order
+    def run_query(start, end, every, locations, query_filters, derived):
+        if not split_parameters:
+            return query_range(start, end, every, locations, query_filters, derived)
+        try:
+            start_dt, end_dt = parse_date(start), parse_date(end)
+            every_td = parse_duration(every) if every else parse_duration("1m")
+        except (ValueError, AssertionError, AttributeError, TypeError): # e.g. relative range or "1mo" interval
+            return query_range(start, end, every, locations, query_filters, derived)
+        if end_dt - start_dt <= split_threshold:
+            return query_range(start, end, every, locations, query_filters, derived)
+        ranges = split_range(start_dt, end_dt, every_td, split_pool.max_workers)
+        bounds = [start] + [dt_to_string(range_end) for _, range_end in ranges[:-1]] + [end]
+        results = split_pool.map(lambda i: query_range(bounds[i], bounds[i + 1], every, locations, query_filters, derived), range(len(ranges)))
+        return merge_results(results)
+    def cached_query(start, end, every, locations, query_filters, derived):
+        try:
+            start_dt, end_dt = parse_date(start), parse_date(end)
+            every_td = parse_duration(every) if every else None
+        except (ValueError, AssertionError, AttributeError, TypeError): # e.g. relative range or "1mo" interval
+            return None
+        if every_td and not (is_aligned(start_dt, every_td) and is_aligned(end_dt, every_td)):
+            return None # partial windows at the edges can't be served from whole chunks
+        key_prefix = (bucket, tuple(query_filters or ()), str(derived), every, frozenset(locations) if locations else None)
+        query_range = lambda chunk_start, chunk_end: run_query(dt_to_string(chunk_start), dt_to_string(chunk_end), every, locations, query_filters, derived)
+        return chunked_query(cache, key_prefix, query_range, start_dt, end_dt, every_td, min_chunk, open_chunk_ttl)
+    # returns the arguments of the query for the request and the requested derived metrics
+    # this connector computes
+    def parse_args(args):
         every = args.get("every")
-        locations = commas_to_list(args.get("locations"))
-        res = query(url, token, org, bucket, start, end, location_variable, metric_variable, every, locations, filters)
+        metrics = commas_to_list(args.get("metrics"))
+        pushed_metrics = [metric for metric in metrics or [] if metric in derived_metrics["expressions"]]
+        derived = None
+        if pushed_metrics:
+            base_metrics = [metric for metric in metrics if metric not in pushed_metrics]
+            # the base metrics the derived ones need are fetched along with the requested ones
+            metrics = sorted(set(base_metrics).union(derived_metrics["plan"].requirements(pushed_metrics)[0]))
+            if every: # derived metrics are computed over the aggregated (float) values
+                derived = (base_metrics, [(metric, derived_metrics["expressions"][metric]) for metric in pushed_metrics])
+        query_filters = influxdb.metric_filters(filters, metrics, metric_variable)
+        return (args.get("start"), args.get("end"), every, commas_to_list(args.get("locations")), query_filters, derived), pushed_metrics
+    # derived metrics that InfluxDB can't compute without every are computed here
+    def evaluate_pushed_metrics(res, pushed_metrics, derived):
+        if pushed_metrics and not derived:
+            with phases.timed("derived_metrics"):
+                res = derived_metrics["plan"].evaluate(res, pushed_metrics)
         return res
+    def influxdb_history_handler(args):
+        query_args, pushed_metrics = parse_args(args)
+        res = cached_query(*query_args) if cache_parameters else None
+        if res is None:
+            res = run_query(*query_args)
+        return evaluate_pushed_metrics(res, pushed_metrics, query_args[-1])
+    # used by the ASGI serving mode; cached and split queries are run by the handler above, in a thread
+    async def influxdb_history_async_handler(args):
+        if cache_parameters or split_parameters:
+            return await asyncio.to_thread(influxdb_history_handler, args)
+        (start, end, every, locations, query_filters, derived), pushed_metrics = parse_args(args)
+        res = await influxdb_async.query(url, token, org, bucket, start, end, location_variable, metric_variable, every, locations, query_filters, rollups, derived)
+        if derived:
+            null_non_finite(res, [name for name, _ in derived[1]])
+        return evaluate_pushed_metrics(res, pushed_metrics, derived)
+    # called by the backend with the compiled derived metrics (see parse_derived_metrics); returns
+    # the ones this connector computes in InfluxDB when they're requested with ?metrics=
+    def push_down(plan):
+        derived_metrics["plan"] = plan
+        if pushdown and metric_variable:
+            for name in plan.outputs:
+                expression = influxdb.derived_flux_expression(plan, name)
+                if expression:
+                    derived_metrics["expressions"][name] = expression
+        return frozenset(derived_metrics["expressions"])
+    influxdb_history_handler.push_down = push_down
+    influxdb_history_handler.async_handler = influxdb_history_async_handler
+    if cache_parameters:
+        influxdb_history_handler.chunk_cache = cache # its hit and miss counters are exposed as metrics
     return influxdb_history_handler
@@ -1,6 +1,12 @@
-from .common.influxdb import query, query_last_timestamp
-from .common.utils import parse_duration
-from datetime import datetime
+from .common.influxdb import query, query_last_timestamp, metric_filters
+from .common import influxdb_async
+from .common.influxdb_clients import set_client_options
+from .common.snapshot import Snapshot
+from .common.data import slice_result
+from .common.assembly import time_to_string
+from .common.utils import parse_duration, align
+from datetime import datetime, timedelta
+import asyncio
 
 def generate_handler(parameters):
     url = parameters["url"]
@@ -10,14 +16,86 @@ def generate_handler(parameters):
     metric_variable = parameters.get("metric_variable")
     location_variable = parameters["location_variable"]
     filters = parameters.get("filters")
+    set_client_options(url, token, org, parameters.get("pool_size"), parameters.get("timeout"))
     offset = parameters["offset"]
     offset_td = parse_duration(offset)
     interval = parameters["interval"]
-    def influxdb_live_handler(_):
-        last_timestamp_in_bucket = query_last_timestamp(url, token, org, bucket, "-30d", location_variable, None, filters)
+    refresh_interval = parameters.get("refresh_interval") # seconds
+    interval_td = parse_duration(interval)
+    # start of the window labeled since: since is a window end, or the end of the range if it's
+    # not aligned, so the window is the interval (aligned to the epoch) just before it
+    def since_window_start(since):
+        return align(datetime.fromisoformat(since.replace("Z", "+00:00")) - timedelta(microseconds=1), interval_td)
+    # since: last timestamp the client already has. Timestamps are the end of each window, except
+    # for the newest one, which is labeled with the end of the range (now) while its window is
+    # still open. So the window labeled since may have been partial: windows are sent again from
+    # the start of the window containing since, which is returned as replace_from (the client
+    # replaces its timestamps after it), along with the start of the current window, before which
+    # the client should drop its timestamps.
+    def live_range(last_timestamp_in_bucket, since):
         last_dt_in_bucket = datetime.fromisoformat(last_timestamp_in_bucket.replace("Z", "+00:00"))
         start_dt = last_dt_in_bucket - offset_td
-        start = start_dt.isoformat()
-        res = query(url, token, org, bucket, start, None, location_variable, metric_variable, interval, None, filters)
+        if since:
+            replace_from_dt = since_window_start(since)
+            start = max(start_dt, replace_from_dt).isoformat()
+        else:
+            replace_from_dt = None
+            start = start_dt.isoformat()
+        return start, start_dt, replace_from_dt
+    def add_since_keys(res, start_dt, replace_from_dt):
+        res["window_start"] = time_to_string(start_dt)
+        res["replace_from"] = time_to_string(replace_from_dt)
+        return res
+    def query_live(since=None, metrics=None):
+        last_timestamp_in_bucket = query_last_timestamp(url, token, org, bucket, "-30d", location_variable, None, filters)
+        start, start_dt, replace_from_dt = live_range(last_timestamp_in_bucket, since)
+        query_filters = metric_filters(filters, metrics, metric_variable)
+        res = query(url, token, org, bucket, start, None, location_variable, metric_variable, interval, None, query_filters)
+        return add_since_keys(res, start_dt, replace_from_dt) if since else res
+    async def query_live_async(since=None, metrics=None):
+        last_timestamp_in_bucket = await influxdb_async.query_last_timestamp(url, token, org, bucket, "-30d", location_variable, None, filters)
+        start, start_dt, replace_from_dt = live_range(last_timestamp_in_bucket, since)
+        query_filters = metric_filters(filters, metrics, metric_variable)
+        res = await influxdb_async.query(url, token, org, bucket, start, None, location_variable, metric_variable, interval, None, query_filters)
+        return add_since_keys(res, start_dt, replace_from_dt) if since else res
+    if not refresh_interval:
+        def influxdb_live_handler(args):
+            metrics = args.get("metrics")
+            return query_live(args.get("since"), metrics.split(",") if metrics else None)
+        # used by the ASGI serving mode
+        async def influxdb_live_async_handler(args):
+            metrics = args.get("metrics")
+            return await query_live_async(args.get("since"), metrics.split(",") if metrics else None)
+        influxdb_live_handler.async_handler = influxdb_live_async_handler
+        return influxdb_live_handler
+    snapshot = Snapshot(query_live, refresh_interval)
+    def influxdb_live_snapshot_handler(args):
+        res, version = snapshot.get()
+        since = args.get("since")
+        if since:
+            window_start = res["timestamps"][0] if res["timestamps"] else since
+            replace_from = time_to_string(since_window_start(since))
+            res = slice_result(res, replace_from, include_last=True) # timestamps > replace_from
+            res["window_start"] = window_start
+            res["replace_from"] = replace_from
+        else:
+            # copy of the top-level dicts, since the result is shared between requests (e.g. derived metrics are added to it)
+            res = {"timestamps": res["timestamps"], "values": dict(res["values"])}
+        res["version"] = version
         return res
-    return influxdb_live_handler
+    # used by the /live/stream endpoint to push new snapshots
+    def subscribe(broadcast_version, timeout):
+        frame, broadcast_version = snapshot.wait(broadcast_version, timeout)
+        if frame is None:
+            return None, broadcast_version
+        res, version = frame
+        return {"timestamps": res["timestamps"], "values": dict(res["values"]), "version": version}, broadcast_version
+    # used by the ASGI serving mode: requests are served from memory, once the first snapshot
+    # has been queried (in a thread)
+    async def influxdb_live_snapshot_async_handler(args):
+        if snapshot.res is None:
+            await asyncio.to_thread(snapshot.get)
+        return influxdb_live_snapshot_handler(args)
+    influxdb_live_snapshot_handler.subscribe = subscribe
+    influxdb_live_snapshot_handler.async_handler = influxdb_live_snapshot_async_handler
+    return influxdb_live_snapshot_handler
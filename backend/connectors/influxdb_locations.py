@@ -1,6 +1,6 @@
 from .common.influxdb import query_range_str
+from .common.influxdb_clients import get_client, set_client_options
 from .common.utils import dt_to_string
-import influxdb_client
 
 def generate_handler(parameters):
     url = parameters["url"]
@@ -11,26 +11,26 @@ def generate_handler(parameters):
     filters = parameters.get("filters")
     start = dt_to_string(parameters["start"])
     latlong_variable = parameters["latlong_variable"]
+    set_client_options(url, token, org, parameters.get("pool_size"), parameters.get("timeout"))
     def influxdb_locations_handler(_):
         res = query_locations(url, token, org, bucket, start, location_variable, latlong_variable, filters)
         return res
     return influxdb_locations_handler
 
 def query_locations(url, token, org, bucket, start, location_variable, latlong_variable, filters=[]):
-    with influxdb_client.InfluxDBClient(url=url, token=token, org=org, debug=False) as client:
-        query_api = client.query_api()
-        query_str = query_range_str(bucket, start, None, None, None, location_variable, filters)
-        tables = query_api.query(query_str)
-        locations = []
-        for table in tables:
-            for record in table.records:
-                location_id = record.values[location_variable]
-                coordinate_index = 1 if record.values[latlong_variable] == "latitude" else 0
-                feature = get_feature_by_id(locations, location_id)
-                if not feature:
-                    feature = new_feature(location_id)
-                    locations.append(feature)
-                feature["geometry"]["coordinates"][coordinate_index] = record.values["_value"]
+    query_api = get_client(url, token, org).query_api()
+    query_str = query_range_str(bucket, start, None, None, None, location_variable, filters)
+    tables = query_api.query(query_str)
+    locations = []
+    for table in tables:
+        for record in table.records:
+            location_id = record.values[location_variable]
+            coordinate_index = 1 if record.values[latlong_variable] == "latitude" else 0
+            feature = get_feature_by_id(locations, location_id)
+            if not feature:
+                feature = new_feature(location_id)
+                locations.append(feature)
+            feature["geometry"]["coordinates"][coordinate_index] = record.values["_value"]
     return locations
 
 def get_feature_by_id(features, id):
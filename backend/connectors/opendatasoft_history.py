@@ -1,4 +1,4 @@
-from .common.opendatasoft import query
+from .common.opendatasoft import query, query_async
 
 def generate_handler(parameters):
     url = parameters["url"]
@@ -11,4 +11,8 @@ def generate_handler(parameters):
         end = args.get("end")
         res = query(url, dataset, start, end, None, timestamp_field, location_field, metric_fields)
         return res
+    # used by the ASGI serving mode
+    async def opendatasoft_history_async_handler(args):
+        return await query_async(url, dataset, args.get("start"), args.get("end"), None, timestamp_field, location_field, metric_fields)
+    opendatasoft_history_handler.async_handler = opendatasoft_history_async_handler
     return opendatasoft_history_handler
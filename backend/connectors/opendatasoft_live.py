@@ -1,4 +1,4 @@
-from .common.opendatasoft import query
+from .common.opendatasoft import query, query_async
 from .common.utils import parse_duration, dt_to_string, array_put_at, uuid, array_pad
 from datetime import datetime
 
@@ -12,9 +12,8 @@ def generate_handler(parameters):
     initial_time_offset = parse_duration(parameters["initial_time_offset"])
     metric_fields = parameters["metric_fields"]
     max_buffer_size = parameters["max_buffer_size"]
-    def opendatasoft_live_handler(args):
-        client_id = args.get("client_id")
-        client_info = clients_info.get(client_id)
+    # returns the range of records to query for the client
+    def query_range(client_info):
         now_minus_offset = dt_to_string(datetime.utcnow() - initial_time_offset)
         if client_info:
             max_record_timestamp = client_info["max_record_timestamp"]
@@ -26,7 +25,8 @@ def generate_handler(parameters):
         else:
             max_record_timestamp = now_minus_offset
             first_timestamp = now_minus_offset
-        res = query(url, dataset, first_timestamp, None, max_record_timestamp, timestamp_field, location_field, metric_fields)
+        return first_timestamp, max_record_timestamp
+    def update_client(res, client_id, client_info):
         max_record_timestamp = res["max_record_timestamp"]
         if not client_info:
             client_id = uuid()
@@ -37,6 +37,20 @@ def generate_handler(parameters):
         clients_info[client_id]["timestamps"] = new_saved_timestamps(clients_info[client_id]["timestamps"], res["timestamps"], max_buffer_size)
         cap_res(res, calc_new_first_timestamp(clients_info[client_id]["timestamps"], res["timestamps"], max_buffer_size))
         return res
+    def opendatasoft_live_handler(args):
+        client_id = args.get("client_id")
+        client_info = clients_info.get(client_id)
+        first_timestamp, max_record_timestamp = query_range(client_info)
+        res = query(url, dataset, first_timestamp, None, max_record_timestamp, timestamp_field, location_field, metric_fields)
+        return update_client(res, client_id, client_info)
+    # used by the ASGI serving mode
+    async def opendatasoft_live_async_handler(args):
+        client_id = args.get("client_id")
+        client_info = clients_info.get(client_id)
+        first_timestamp, max_record_timestamp = query_range(client_info)
+        res = await query_async(url, dataset, first_timestamp, None, max_record_timestamp, timestamp_field, location_field, metric_fields)
+        return update_client(res, client_id, client_info)
+    opendatasoft_live_handler.async_handler = opendatasoft_live_async_handler
     return opendatasoft_live_handler
 
 # pre: len(saved_timestamps + res_timestamps) > 0
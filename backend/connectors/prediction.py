@@ -1,6 +1,7 @@
 from datetime import datetime
 from uuid import uuid4
 from ..forecasting.polling_job import run_job_on_new_thread
+from .common.broadcast import Broadcast
 
 # stored result with real values and predicted values
 result = {}
@@ -11,10 +12,14 @@ last_data_version = 0
 # maps client id to last data version
 clients_last_data_version = {}
 
+# publishes each new result to the /prediction/stream subscribers
+changes = Broadcast()
+
 def new_data_handler(values):
     global result, last_data_version
     result = values
     last_data_version += 1
+    changes.publish(values)
 
 def generate_handler(parameters):
     model_name = parameters["model_name"]
@@ -35,4 +40,10 @@ def generate_handler(parameters):
             return result
         else:
             return {}
+    def subscribe(broadcast_version, timeout):
+        frame, broadcast_version = changes.wait(broadcast_version, timeout)
+        if frame is None:
+            return None, broadcast_version
+        return dict(frame, values=dict(frame["values"])), broadcast_version
+    prediction_handler.subscribe = subscribe
     return prediction_handler
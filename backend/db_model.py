@@ -21,3 +21,15 @@ class User(db.Model, UserMixin):
     def get_id(self):
         return self.unique_token
 
+
+# emails waiting to be delivered by the outbox (see outbox.py)
+class Email(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    created = db.Column(db.DateTime, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt = db.Column(db.DateTime, index=True) # null once given up; moved forward while being delivered
+    sent = db.Column(db.DateTime)
+    last_error = db.Column(db.String(255))
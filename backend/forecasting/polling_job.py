@@ -4,10 +4,10 @@ from time import sleep
 from copy import deepcopy
 from threading import Thread
 import sys
-import influxdb_client
 from influxdb_client import Point
 import numpy as np
 from importlib import import_module
+from ..connectors.common.influxdb_clients import get_client, set_client_options
 
 # TODO deduplicate this function
 def parse_duration(duration):
@@ -43,6 +43,7 @@ class Forecaster:
         self.bucket = parameters["bucket"]
         self.metric_variable = parameters["metric_variable"] # TODO use this
         self.location_variable = parameters["location_variable"]
+        set_client_options(self.url, self.token, self.org, parameters.get("pool_size"), parameters.get("timeout"))
 
         self.MIN_REAL_TIMESTAMPS = parameters.get("min_real_timestamps")
         self.MAX_LOCAL_TO_OVERALL_GAP = parse_duration(parameters["max_local_to_overall_gap"])
@@ -68,20 +69,19 @@ class Forecaster:
         return self.get_query_values(query_str)
 
     def get_query_values(self, query_str):
-        with influxdb_client.InfluxDBClient(url=self.url, token=self.token, org=self.org, debug=False) as client:
-            query_api = client.query_api()
-            tables = query_api.query(query_str)
-            timestamps = set()
-            values = {}
-            for table in tables:
-                for record in table.records:
-                    timestamp = record.values["_time"].isoformat().replace("+00:00", "Z")
-                    timestamps.add(timestamp)
-                    location = record.values[self.location_variable]
-                    value = record.values["_value"]
-                    if location not in values:
-                        values[location] = {}
-                    values[location][timestamp] = value
+        query_api = get_client(self.url, self.token, self.org).query_api()
+        tables = query_api.query(query_str)
+        timestamps = set()
+        values = {}
+        for table in tables:
+            for record in table.records:
+                timestamp = record.values["_time"].isoformat().replace("+00:00", "Z")
+                timestamps.add(timestamp)
+                location = record.values[self.location_variable]
+                value = record.values["_value"]
+                if location not in values:
+                    values[location] = {}
+                values[location][timestamp] = value
 
         sorted_timestamps = sorted(timestamps)
         # now we select the final N timestamps for which values will be considered
@@ -1,9 +1,83 @@
 import bcrypt
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+import math
+import os
+import sys
+
+# bcrypt runs in a small process pool, so that a burst of logins doesn't hold the request
+# workers' CPU; at most queue_size hashes may be pending, further ones raise HashingBusy
+class HashingBusy(Exception):
+    pass
+
+options = {"rounds": 12, "workers": 1, "queue_size": 16, "python": None}
+pool = {"executor": None, "slots": None, "lock": Lock()}
+
+def hashpw(pwd, rounds):
+    return bcrypt.hashpw(pwd.encode(), bcrypt.gensalt(rounds)).decode()
+
+def checkpw(pwd, pwd_hash):
+    return bcrypt.checkpw(pwd.encode(), pwd_hash.encode())
+
+# rounds: bcrypt cost factor; if None, the highest one (at least 10) whose hashes take at
+# most target_ms here. workers: processes in the pool, 0 to hash in the calling thread.
+# python: interpreter running the pool's fork server (see python_executable)
+def configure_hashing(rounds=None, target_ms=250, workers=1, queue_size=16, python=None):
+    options["rounds"] = rounds or calibrate(target_ms)
+    options["workers"] = workers
+    options["queue_size"] = queue_size
+    options["python"] = python
+    print(f"bcrypt rounds: {options['rounds']}", file=sys.stderr)
+
+def calibrate(target_ms, min_rounds=10, max_rounds=16):
+    start_time = perf_counter()
+    hashpw("calibration", min_rounds)
+    elapsed_ms = (perf_counter() - start_time) * 1000
+    # each additional round doubles the time
+    extra_rounds = math.floor(math.log2(target_ms / elapsed_ms)) if elapsed_ms < target_ms else 0
+    return min(max_rounds, min_rounds + extra_rounds)
+
+# under uWSGI, sys.executable is the uwsgi binary, which multiprocessing can't start as a
+# python interpreter; then it's the interpreter of the same version in sys.exec_prefix
+def python_executable():
+    if options["python"]:
+        return options["python"]
+    if os.path.basename(sys.executable).startswith("python"):
+        return sys.executable
+    return os.path.join(sys.exec_prefix, "bin", "python{}.{}".format(*sys.version_info[:2]))
+
+def run(f, *args):
+    if options["workers"] == 0:
+        return f(*args)
+    if pool["executor"] is None:
+        with pool["lock"]:
+            if pool["executor"] is None:
+                # created on first use, in the (forked) process that hashes. By then this process
+                # runs other threads (e.g. the activity flusher and the InfluxDB clients' pools),
+                # so the pool's processes are forked from a single-threaded fork server instead
+                context = get_context("forkserver")
+                context.set_executable(python_executable()) # also used to start multiprocessing's resource tracker
+                pool["slots"] = BoundedSemaphore(options["queue_size"])
+                pool["executor"] = ProcessPoolExecutor(max_workers=options["workers"], mp_context=context)
+    slots = pool["slots"]
+    if not slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        return pool["executor"].submit(f, *args).result()
+    finally:
+        slots.release()
+
+def forget_pool():
+    pool["executor"] = None
+    pool["slots"] = None
+    pool["lock"] = Lock()
+
+os.register_at_fork(after_in_child=forget_pool)
 
 def gen_hash(pwd):
-    pwd_salt = bcrypt.gensalt()
-    pwd_hash = bcrypt.hashpw(pwd.encode(), pwd_salt).decode()
-    return pwd_hash
+    return run(hashpw, pwd, options["rounds"])
 
 def check_hash(pwd, pwd_hash):
-    return bcrypt.checkpw(pwd.encode(), pwd_hash.encode())
+    return run(checkpw, pwd, pwd_hash)
@@ -1,5 +1,6 @@
 import influxdb_client
 from datetime import timedelta, datetime
+import atexit
 
 def init(parameters, write_points):
     url = parameters["url"]
@@ -8,26 +9,33 @@ def init(parameters, write_points):
     query_str_template = parameters["query"]
     location_variable = parameters["location_variable"]
     ignore_before = parameters.get("ignore_before")
+    # one client for the lifetime of the ingestion process, reusing its keep-alive connections
+    client_options = {}
+    if parameters.get("pool_size"):
+        client_options["connection_pool_maxsize"] = parameters["pool_size"]
+    if parameters.get("timeout"):
+        client_options["timeout"] = parameters["timeout"]
+    client = influxdb_client.InfluxDBClient(url=url, token=token, org=org, debug=False, **client_options)
+    atexit.register(client.close)
+    query_api = client.query_api()
     def ingest_from(start_timestamp):
         start = datetime.fromisoformat(start_timestamp)
         if ignore_before:
             start = start - parse_duration(ignore_before)
         query_str = query_str_template.replace("START", start.isoformat())
-        with influxdb_client.InfluxDBClient(url=url, token=token, org=org, debug=False) as client:
-            query_api = client.query_api()
-            tables = query_api.query(query_str)
-            points = []
-            max_dt = start
-            for table in tables:
-                for record in table.records:
-                    # TODO be metric-aware
-                    dt = record.values["_time"]
-                    points.append(influxdb_client.Point(record.values[location_variable])
-                        .tag("metric", "all")
-                        .field("_value", record.values["_value"])
-                        .time(dt))
-                    if dt > max_dt:
-                        max_dt = dt
+        tables = query_api.query(query_str)
+        points = []
+        max_dt = start
+        for table in tables:
+            for record in table.records:
+                # TODO be metric-aware
+                dt = record.values["_time"]
+                points.append(influxdb_client.Point(record.values[location_variable])
+                    .tag("metric", "all")
+                    .field("_value", record.values["_value"])
+                    .time(dt))
+                if dt > max_dt:
+                    max_dt = dt
         write_points(points)
         print(f"Wrote {len(points)} points")
         return dt
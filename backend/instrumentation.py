@@ -0,0 +1,113 @@
+# Latency and size histograms of the data endpoints, exposed in the Prometheus text format.
+# Each process keeps its own histograms: with several uWSGI workers, /metrics only reports
+# the worker that serves it, so each scrape samples one of them.
+from threading import Lock
+from time import perf_counter
+from bisect import bisect_left
+import os
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(10)) # 1KiB to 256MiB
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one is +Inf
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+# name -> (description, buckets, {label values tuple -> Histogram}), with the label names
+histograms = {
+    "crowding_request_seconds": ("Duration of requests, until their response is sent", SECONDS_BUCKETS, {}),
+    "crowding_request_phase_seconds": ("Duration of each phase of requests", SECONDS_BUCKETS, {}),
+    "crowding_response_bytes": ("Size of response bodies", BYTES_BUCKETS, {}),
+}
+label_names = {
+    "crowding_request_seconds": ("endpoint", "connector"),
+    "crowding_request_phase_seconds": ("endpoint", "connector", "phase"),
+    "crowding_response_bytes": ("endpoint", "connector"),
+}
+lock = Lock()
+
+# functions returning [(name, description, {label values tuple -> value}, label names)] of counters
+counter_sources = []
+
+def observe(name, labels, value):
+    _, buckets, series = histograms[name]
+    with lock:
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = Histogram(buckets)
+        histogram.observe(value)
+
+def forget():
+    with lock:
+        for _, _, series in histograms.values():
+            series.clear()
+
+os.register_at_fork(after_in_child=forget) # the parent's observations are not the worker's
+
+def observe_request(endpoint, connector, durations, total, size):
+    observe("crowding_request_seconds", (endpoint, connector), total)
+    observe("crowding_response_bytes", (endpoint, connector), size)
+    for phase, seconds in durations.items():
+        observe("crowding_request_phase_seconds", (endpoint, connector, phase), seconds)
+
+# response body wrapper that measures the time spent producing the chunks (serialization,
+# for streamed responses) and the bytes sent; on_close(serialization seconds, bytes) is
+# called when the server closes the response
+class TimedBody:
+
+    def __init__(self, chunks, wrapped, on_close):
+        self.chunks = chunks # encoded chunks of wrapped
+        self.wrapped = wrapped
+        self.on_close = on_close
+        self.serialization = 0
+        self.size = 0
+
+    def __iter__(self):
+        iterator = iter(self.chunks)
+        while True:
+            start_time = perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.serialization += perf_counter() - start_time
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        if hasattr(self.wrapped, "close"):
+            self.wrapped.close()
+        self.on_close(self.serialization, self.size)
+
+def label_str(names, values):
+    return ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in zip(names, values))
+
+def render():
+    lines = []
+    with lock:
+        for name, (description, buckets, series) in histograms.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in sorted(series.items()):
+                labels_str = label_str(label_names[name], labels)
+                cumulative = 0
+                for bound, count in zip(buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels_str},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels_str}}} {histogram.sum}")
+                lines.append(f"{name}_count{{{labels_str}}} {cumulative}")
+    for source in counter_sources:
+        for name, description, values, names in source():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(values.items()):
+                lines.append(f"{name}{{{label_str(names, labels)}}} {value}" if names else f"{name} {value}")
+    return "\n".join(lines) + "\n"
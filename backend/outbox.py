@@ -0,0 +1,124 @@
+# Durable outbox for emails: requests only add the email to the database session, in the
+# same transaction as the change that triggers it, and a background thread delivers pending
+# emails in batches over one transport connection, retrying failures with exponential backoff.
+# Several processes may run a sender: each email is claimed by moving its next_attempt forward.
+# Bodies may hold secrets (e.g. activation links), so they're blanked once the email is sent or
+# given up, and emails still unsent after max_age are given up.
+from datetime import datetime, timedelta
+from threading import Thread, Event, Lock
+import os
+import sys
+
+if os.environ.get("ENV") == "local":
+    from .send_email import make_message
+else:
+    from send_email import make_message
+
+class Outbox:
+
+    def __init__(self, app, db, model, transport, sender, poll_interval=30, batch_size=20, max_attempts=5, retry_delay=60, lease=300, max_age=86400):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.transport = transport
+        self.sender = sender
+        self.poll_interval = poll_interval # seconds between checks for emails to retry
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = timedelta(seconds=retry_delay) # doubled after each failed attempt
+        self.lease = timedelta(seconds=lease) # time a claimed email is reserved for its sender
+        self.max_age = timedelta(seconds=max_age)
+        self.event = Event()
+        self.lock = Lock()
+        self.thread = None
+        os.register_at_fork(after_in_child=self.forget)
+
+    # adds the email to the current session; it's delivered once the session is committed and wake is called
+    def enqueue(self, recipient, subject, body):
+        now = datetime.now()
+        self.db.session.add(self.model(recipient=recipient, subject=subject, body=body, created=now, attempts=0, next_attempt=now))
+
+    def wake(self):
+        self.start()
+        self.event.set()
+
+    def start(self):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = Thread(target=self.run, daemon=True)
+                    self.thread.start()
+
+    def forget(self):
+        self.event = Event()
+        self.lock = Lock()
+        self.thread = None
+
+    def run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self.expire()
+                    while self.deliver_batch() == self.batch_size:
+                        pass
+            except Exception as e:
+                print(f"error delivering emails: {e}", file=sys.stderr)
+            self.event.wait(self.poll_interval)
+            self.event.clear()
+
+    # gives up the emails older than max_age and blanks the bodies of all the emails that are
+    # done with (including those left by other processes, or from before bodies were blanked)
+    def expire(self):
+        model = self.model
+        session = self.db.session
+        session.execute(self.db.update(model)
+            .where(model.sent == None, model.next_attempt != None, model.created < datetime.now() - self.max_age)
+            .values(next_attempt=None, last_error="expired"))
+        session.execute(self.db.update(model)
+            .where(model.body != "", self.db.or_(model.sent != None, model.next_attempt == None))
+            .values(body=""))
+        session.commit()
+
+    # delivers up to batch_size due emails; returns the number of due emails found
+    def deliver_batch(self):
+        model = self.model
+        session = self.db.session
+        now = datetime.now()
+        due = session.execute(self.db.select(model.id, model.next_attempt)
+            .where(model.sent == None, model.next_attempt <= now)
+            .order_by(model.next_attempt).limit(self.batch_size)).all()
+        claimed = []
+        for email_id, next_attempt in due:
+            claim = self.db.update(model).where(model.id == email_id, model.next_attempt == next_attempt).values(next_attempt=now + self.lease)
+            if session.execute(claim).rowcount == 1: # otherwise claimed by another process
+                claimed.append(email_id)
+        session.commit()
+        connection = None
+        try:
+            for email in session.scalars(self.db.select(model).where(model.id.in_(claimed))).all():
+                try:
+                    if connection is None:
+                        connection = self.transport.open()
+                    connection.sendmail(self.sender, email.recipient, make_message(email.subject, email.body, self.sender, email.recipient))
+                    email.sent = datetime.now()
+                    email.body = ""
+                except Exception as e:
+                    email.attempts += 1
+                    email.last_error = str(e)[:255]
+                    email.next_attempt = now + self.retry_delay * 2 ** (email.attempts - 1) if email.attempts < self.max_attempts else None
+                    if email.next_attempt is None:
+                        email.body = ""
+                    print(f"error sending email {email.id} (attempt {email.attempts}): {e}", file=sys.stderr)
+                    connection = close_quietly(connection) # may be broken, reopened for the next email
+                session.commit() # one by one, so that a crash doesn't send them again
+        finally:
+            close_quietly(connection)
+        return len(due)
+
+def close_quietly(connection):
+    if connection is not None:
+        try:
+            connection.close()
+        except Exception:
+            pass
+    return None
@@ -1,21 +1,187 @@
 from parsimonious.grammar import Grammar
 from parsimonious.nodes import NodeVisitor
+import numpy as np
 
-def add_derived_metrics(res, derived_metrics):
-    for derived_metric in derived_metrics:
-        add_derived_metric(res, derived_metric, derived_metrics[derived_metric])
-
-def add_derived_metric(res, derived_metric_name, derived_metric_expression):
-    expr = derived_metric_expression.replace(" ", "") # remove whitespace
-    ast = grammar.parse(expr)
-    metrics = get_referenced_metrics(ast)
-    if len(metrics) == 0: # constant expression
-        add_constant_expression(res, derived_metric_name, calc(ast, {}))
-    else:
-        res["values"][derived_metric_name] = {}
-        for location in res["values"][metrics[0]]:
-            if location_in_all_metrics(location, res, metrics):
-                res["values"][derived_metric_name][location] = location_values(location, res, metrics, ast)   
+# derived metrics are compiled once, when the endpoint is configured, into a plan: a DAG of
+# operations over the base metrics, in which derived metrics may reference other derived
+# metrics and identical subexpressions are shared. On each request only the operations needed
+# by the requested metrics are run, over whole (location x time) NumPy arrays with nulls as
+# NaN, and only the results are converted back to lists
+
+class DerivedMetricsPlan:
+
+    def __init__(self, derived_metrics):
+        self.steps = [] # (operation, argument); operators' arguments are indexes of earlier steps
+        self.step_indexes = {} # step -> index, so that identical subexpressions are compiled once
+        self.outputs = {} # derived metric -> (index of its step, base metrics it depends on)
+        self.expressions = {name: grammar.parse(derived_metrics[name].replace(" ", "")) for name in derived_metrics}
+        for name in derived_metrics:
+            self.compile_metric(name, ())
+
+    def compile_metric(self, name, referencing):
+        if name in referencing:
+            raise ValueError("circular derived metric: " + " -> ".join(referencing + (name,)))
+        if name not in self.outputs:
+            visitor = CompileExpressionVisitor(self, referencing + (name,))
+            index = visitor.visit(self.expressions[name])
+            # a null (e.g. division by zero) in a derived metric stays null in metrics referencing it
+            self.outputs[name] = (self.add_step("finite", (index,)), frozenset(visitor.base_metrics))
+        return self.outputs[name]
+
+    def add_step(self, operation, argument):
+        if operation in OPERATIONS and all(self.steps[i][0] == "constant" for i in argument):
+            # constant folding
+            return self.add_step("constant", float(run_operation(operation, [self.steps[i][1] for i in argument])))
+        step = (operation, argument)
+        if step not in self.step_indexes:
+            self.step_indexes[step] = len(self.steps)
+            self.steps.append(step)
+        return self.step_indexes[step]
+
+    # returns the base metrics to fetch and the derived metrics to compute for the requested metrics
+    def requirements(self, metrics):
+        base_metrics = set()
+        derived_metrics = []
+        for metric in metrics:
+            if metric in self.outputs:
+                base_metrics.update(self.outputs[metric][1])
+                derived_metrics.append(metric)
+            else:
+                base_metrics.add(metric)
+        return sorted(base_metrics), derived_metrics
+
+    # returns the result with the given derived metrics (all if None) added; the given result
+    # isn't modified, since connectors may return the same one to every request
+    def evaluate(self, res, derived_metrics=None):
+        if derived_metrics is None:
+            derived_metrics = list(self.outputs)
+        if len(derived_metrics) == 0 or "values" not in res: # e.g. the client id response of /prediction
+            return res
+        res = dict(res, values=dict(res["values"]))
+        needed = {self.outputs[name][0] for name in derived_metrics}
+        for index in range(len(self.steps) - 1, -1, -1): # arguments always precede their step
+            operation, argument = self.steps[index]
+            if index in needed and operation in OPERATIONS:
+                needed.update(argument)
+        base_metrics = [self.steps[index][1] for index in sorted(needed) if self.steps[index][0] == "metric"]
+        locations, present, dense, lists = dense_values(res, base_metrics)
+        step_values = {}
+        for index in sorted(needed):
+            operation, argument = self.steps[index]
+            if operation == "metric":
+                step_values[index] = dense[argument]
+            elif operation == "constant":
+                step_values[index] = argument
+            else:
+                step_values[index] = run_operation(operation, [step_values[i] for i in argument])
+        for name in derived_metrics:
+            index, metric_base_metrics = self.outputs[name]
+            if len(metric_base_metrics) == 0: # constant expression
+                value = step_values[index]
+                add_constant_expression(res, name, None if np.isnan(value) else value)
+                continue
+            rows = np.ones(len(locations), dtype=bool) # locations that have all the base metrics
+            for metric in metric_base_metrics:
+                rows &= present[metric]
+            rows = np.nonzero(rows)[0]
+            values = step_values[index][rows]
+            list_cells = [lists[metric][rows] for metric in metric_base_metrics if lists[metric] is not None]
+            if list_cells: # a list where any of the base metrics has one (e.g. predicted quartiles)
+                series = [list_series(row_values, row_list_cells) for row_values, row_list_cells in zip(values, np.logical_or.reduce(list_cells))]
+            else:
+                if values.ndim == 3: # other metrics have lists
+                    values = values[:, :, 0]
+                series = to_objects(values).tolist()
+            res["values"][name] = dict(zip([locations[i] for i in rows], series))
+        return res
+
+OPERATIONS = ("+", "-", "*", "/", "finite")
+
+def run_operation(operation, arguments):
+    with np.errstate(all="ignore"):
+        if operation == "+":
+            return np.add(*arguments)
+        if operation == "-":
+            return np.subtract(*arguments)
+        if operation == "*":
+            return np.multiply(*arguments)
+        if operation == "/":
+            left, right = arguments
+            return np.where(np.equal(right, 0), np.nan, np.divide(left, right)) # division by zero is null
+        if operation == "finite": # infinities (overflow) are null
+            value, = arguments
+            return np.where(np.isfinite(value), value, np.nan)
+    raise ValueError("unknown operation " + operation)
+
+def to_objects(values):
+    objects = values.astype(object)
+    objects[np.isnan(values)] = None
+    return objects
+
+def list_series(values, list_cells):
+    return [to_objects(value).tolist() if is_list else to_objects(value[:1])[0] for value, is_list in zip(values, list_cells)]
+
+# returns the union of the locations of the given base metrics, a mask of the locations that
+# have each metric, each metric's values as a (location x time) array, NaN where missing, and
+# a (location x time) mask of the values that are lists (e.g. the quartiles of predictions;
+# None if there are none). If any metric has lists, all arrays are (location x time x list
+# length), with scalars repeated along the last axis, so that each element is computed separately
+def dense_values(res, metrics):
+    locations = {} # location -> row
+    for metric in metrics:
+        for location in res["values"].get(metric, {}):
+            locations.setdefault(location, len(locations))
+    length = len(res["timestamps"])
+    present = {}
+    dense = {}
+    lists = {}
+    for metric in metrics:
+        metric_values = res["values"].get(metric, {})
+        rows = [locations[location] for location in metric_values]
+        present[metric] = np.zeros(len(locations), dtype=bool)
+        present[metric][rows] = True
+        values, list_cells = series_array(list(metric_values.values()), length)
+        dense[metric] = np.full((len(locations),) + values.shape[1:], np.nan)
+        lists[metric] = None
+        if list_cells is not None:
+            lists[metric] = np.zeros((len(locations), length), dtype=bool)
+        if len(rows) > 0:
+            dense[metric][rows] = values
+            if list_cells is not None:
+                lists[metric][rows] = list_cells
+    if any(metric_lists is not None for metric_lists in lists.values()):
+        dense = {metric: values if values.ndim == 3 else values[:, :, np.newaxis] for metric, values in dense.items()}
+    return list(locations), present, dense, lists
+
+# returns the series as a float array (None becomes NaN) and the mask of the list values
+def series_array(series, length):
+    try:
+        values = np.array(series, dtype=np.float64)
+        if values.ndim == 2 and values.shape[1] == length:
+            return values, None
+        if values.ndim == 3 and values.shape[1] == length:
+            return values, np.ones(values.shape[:2], dtype=bool)
+    except ValueError: # lists and scalars
+        pass
+    width = max((len(value) for values in series for value in values if isinstance(value, list)), default=1)
+    values = np.full((len(series), length, width), np.nan)
+    list_cells = np.zeros((len(series), length), dtype=bool)
+    for row, row_values in enumerate(series):
+        for column, value in enumerate(row_values[:length]): # series of other lengths are cut or padded
+            if isinstance(value, list):
+                list_cells[row, column] = True
+                values[row, column, :len(value)] = [np.nan if element is None else element for element in value]
+            elif value is not None:
+                values[row, column] = value
+    if not list_cells.any():
+        return values[:, :, 0], None
+    return values, list_cells
+
+def compile_derived_metrics(derived_metrics):
+    return DerivedMetricsPlan(derived_metrics)
+
+def add_derived_metrics(res, plan, derived_metrics=None):
+    return plan.evaluate(res, derived_metrics)
 
 def add_constant_expression(res, metric_name, value):
     timestamps_size = len(res["timestamps"])
@@ -24,22 +190,6 @@ def add_constant_expression(res, metric_name, value):
         for location in res["values"][metric]:
             res["values"][metric_name][location] = [value] * timestamps_size
 
-def location_in_all_metrics(location, res, metrics):
-    for metric in metrics:
-        if location not in res["values"][metric]:
-            return False
-    return True
-
-def location_values(location, res, metrics, ast):
-    values = []
-    for i in range(len(res["values"][metrics[0]][location])):
-        id_values = {}
-        for metric in metrics:
-            id_values[metric] = res["values"][metric][location][i]
-        value = calc(ast, id_values)
-        values.append(value)
-    return values
-
 grammar = Grammar(
     r"""
     sum = product plus_or_minus?
@@ -55,34 +205,24 @@ grammar = Grammar(
     """
 )
 
-class ListIdentifiersVisitor(NodeVisitor):
-    _identifiers = set()
-
-    def visit_identifier(self, node, visited_children):
-        identifier = node.match.group()
-        self._identifiers.add(identifier)
-
-    def generic_visit(self, node, visited_children):
-        # ignore non-identifier nodes
-        pass
-
-    def identifiers(self):
-        return list(self._identifiers)
+# adds the steps of an expression to the plan and returns the index of its last step;
+# identifiers naming other derived metrics are compiled (once) and referenced, the others
+# (and the metric's own name, which refers to the base metric it replaces) are base metrics
+class CompileExpressionVisitor(NodeVisitor):
+    unwrapped_exceptions = (ValueError,) # circular references are reported as such, not as a VisitationError
 
-class CalcExpressionVisitor(NodeVisitor):
-    def __init__(self, id_values):
-        self._id_values = id_values
+    def __init__(self, plan, referencing):
+        self._plan = plan
+        self._referencing = referencing # chain of derived metrics being compiled, to detect cycles
+        self.base_metrics = set()
 
     def visit_sum(self, node, visited_children):
         res = visited_children[0]
         if visited_children[1]:
             operator, right = visited_children[1]
-            try:
-                res = res + right if operator == "+" else res - right
-            except TypeError: # some variable is null
-                res = None
+            res = self._plan.add_step(operator, (res, right))
         return res
-    
+
     def visit_plus_or_minus(self, node, visited_children):
         operator = node.children[0].text
         return [operator, visited_children[1]]
@@ -91,48 +231,40 @@ class CalcExpressionVisitor(NodeVisitor):
         res = visited_children[0]
         if visited_children[1]:
             operator, right = visited_children[1]
-            try:
-                res = res * right if operator == "*" else res / right
-            except TypeError: # some variable is null
-                res = None
+            res = self._plan.add_step(operator, (res, right))
         return res
 
     def visit_mult_or_div(self, node, visited_children): #NOSONAR
         operator = node.children[0].text
         return [operator, visited_children[1]]
-        
+
     def visit_atom(self, node, visited_children):
         return visited_children[0]
-    
+
     def visit_paren_expr(self, node, visited_children):
         assert len(visited_children) == 3
         return visited_children[1]
 
     def visit_identifier(self, node, visited_children):
         identifier = node.text
-        return self._id_values[identifier]
-    
+        if identifier in self._plan.expressions and identifier != self._referencing[-1]:
+            index, base_metrics = self._plan.compile_metric(identifier, self._referencing)
+            self.base_metrics.update(base_metrics)
+            return index
+        self.base_metrics.add(identifier)
+        return self._plan.add_step("metric", identifier)
+
     def visit_constant(self, node, visited_children):
         return visited_children[0]
 
     def visit_float(self, node, visited_children):
-        return float(node.text)
-    
+        return self._plan.add_step("constant", float(node.text))
+
     def visit_int(self, node, visited_children):
-        return int(node.text)
-    
+        return self._plan.add_step("constant", float(node.text))
+
     def generic_visit(self, node, visited_children):
         if len(visited_children) > 0:
             return visited_children[0]
         else:
             return None
-
-
-def get_referenced_metrics(ast):
-    ids_visitor = ListIdentifiersVisitor()
-    ids_visitor.visit(ast)
-    return ids_visitor.identifiers()
-
-def calc(ast, id_values):
-    visitor = CalcExpressionVisitor(id_values)
-    return visitor.visit(ast)
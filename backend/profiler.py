@@ -0,0 +1,106 @@
+# Sampling profiler for single requests: a thread periodically samples the stack of the
+# request's thread and counts each distinct stack, which is returned in the folded format
+# ("root;caller;callee count" per line) read by flamegraph.pl, speedscope or inferno.
+# Only the request's thread is sampled: time spent in thread pools shows as waiting.
+# When gevent has monkey-patched threading (see the Dockerfile's uWSGI command), requests are
+# greenlets: the request's greenlet is sampled from a native thread, since a sampling greenlet
+# would only run while the request waits.
+from collections import Counter
+from threading import Lock
+from time import monotonic
+import _thread
+import os
+import sys
+import time
+
+try:
+    from gevent import monkey as gevent_monkey
+except ImportError:
+    gevent_monkey = None
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def folded_stack(frame):
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+# the module's (_thread or time) function, as it was before gevent monkey-patched it
+def native(module_name, name):
+    if gevent_monkey is not None and gevent_monkey.is_module_patched(module_name):
+        return gevent_monkey.get_original(module_name, name)
+    return getattr(sys.modules[module_name], name)
+
+# returns a function returning the current frame of the calling thread or greenlet, or None once it's gone
+def current_frame_getter():
+    thread_id = native("_thread", "get_ident")()
+    if gevent_monkey is None or not gevent_monkey.is_module_patched("threading"):
+        return lambda: sys._current_frames().get(thread_id)
+    import gevent
+    greenlet = gevent.getcurrent()
+    # a greenlet that isn't running keeps its frame; a running one is the native thread's current frame
+    def current_frame():
+        if greenlet.dead:
+            return None
+        return greenlet.gr_frame or sys._current_frames().get(thread_id)
+    return current_frame
+
+class SamplingProfiler:
+
+    def __init__(self, interval):
+        self.interval = interval # seconds between samples
+        self.stacks = Counter()
+        self.stopped = False
+        self.done = None # held by the sampling thread while it runs
+
+    # samples the calling thread (or greenlet) until stop is called
+    def start(self):
+        self.done = native("_thread", "allocate_lock")()
+        self.done.acquire()
+        native("_thread", "start_new_thread")(self.run, (current_frame_getter(), native("time", "sleep")))
+
+    def run(self, current_frame, sleep):
+        try:
+            while True:
+                sleep(self.interval)
+                if self.stopped:
+                    return
+                frame = current_frame()
+                if frame is None:
+                    return
+                self.stacks[folded_stack(frame)] += 1
+        finally:
+            self.done.release()
+
+    def stop(self):
+        self.stopped = True
+        self.done.acquire() # until the sampling thread returns, within one interval
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+# allows one profiled request at a time per process, at most every min_interval seconds
+class ProfileGate:
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self.lock = Lock()
+        self.running = False
+        self.last_start = None
+
+    def acquire(self):
+        with self.lock:
+            now = monotonic()
+            if self.running or (self.last_start is not None and now - self.last_start < self.min_interval):
+                return False
+            self.running = True
+            self.last_start = now
+            return True
+
+    def release(self):
+        with self.lock:
+            self.running = False
@@ -1,11 +1,38 @@
 import smtplib
+import sys
 from email.mime.text import MIMEText
 
-def send_email(subject, body, sender, recipient, password):
+def make_message(subject, body, sender, recipient):
     msg = MIMEText(body)
     msg['Subject'] = subject
     msg['From'] = sender
     msg['To'] = recipient
-    with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp_server:
-       smtp_server.login(sender, password)
-       smtp_server.sendmail(sender, recipient, msg.as_string())
+    return msg.as_string()
+
+# Transports open connections with sendmail(sender, recipient, message) and close(), like smtplib's
+
+class SMTPTransport:
+
+    def __init__(self, sender, password, host='smtp.gmail.com', port=465, timeout=30):
+        self.sender = sender
+        self.password = password
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def open(self):
+        smtp_server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        smtp_server.login(self.sender, self.password)
+        return smtp_server
+
+# local stand-in, which prints the messages instead of sending them
+class LogTransport:
+
+    def open(self):
+        return self
+
+    def sendmail(self, sender, recipient, message):
+        print("email from {} to {}:\n{}".format(sender, recipient, message), file=sys.stderr)
+
+    def close(self):
+        pass
@@ -0,0 +1,85 @@
+# Coalesces identical concurrent calls: while a call for a key is in flight, further
+# calls for the same key wait for it and share its result (or its exception).
+from threading import Event, Lock
+import asyncio
+
+class Call:
+
+    def __init__(self, done=None):
+        self.done = done or Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+
+    def __init__(self):
+        self.lock = Lock()
+        self.calls = {} # key -> in-flight Call
+        self.async_calls = {} # key -> in-flight Call of do_async
+        self.requests = 0
+        self.coalesced = 0 # requests answered with the result of another request's call
+
+    def do(self, key, f):
+        with self.lock:
+            self.requests += 1
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = f()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+    # coroutine counterpart of do, for calls made from one event loop (see asgi.py)
+    async def do_async(self, key, f):
+        with self.lock:
+            self.requests += 1
+            call = self.async_calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.async_calls[key] = Call(asyncio.Event())
+            else:
+                self.coalesced += 1
+        if not leader:
+            await call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = await f()
+        except BaseException as e: # e.g. cancelled, if the leader's client disconnected
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.async_calls[key]
+            call.done.set()
+        return call.result
+
+# per-endpoint SingleFlight instances, whose counters are reported by the backend
+flights = {}
+
+# wraps a connector handler so that concurrent requests with the same arguments share one
+# computation; the shared result must not be modified by the callers
+def coalesce(handler, name):
+    flight = flights[name] = SingleFlight()
+    def coalesced_handler(args):
+        return flight.do(args_key(args), lambda: handler(args))
+    return coalesced_handler
+
+def args_key(args):
+    return tuple(sorted((k, tuple(v)) for k, v in args.lists()))
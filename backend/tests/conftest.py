@@ -0,0 +1,40 @@
+# The backend's modules are imported as in the Docker image (from the backend directory),
+# except for the app, which is imported as the backend package with ENV=local.
+import json
+import os
+import sys
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+HISTORY = {"timestamps": ["2024-01-01T01:00:00Z", "2024-01-01T02:00:00Z"], "values": {"C1": {"a": [1, 2]}, "C2": {"a": [2, 4]}}}
+
+# the Flask app, configured with a static /history with derived metrics; the backend reads its
+# configuration on import, so there is one app per test session
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("backend")
+    with open(directory / "history.json", "w") as f:
+        json.dump(HISTORY, f)
+    with open(directory / "locations.json", "w") as f:
+        json.dump([{"type": "Feature", "properties": {"id": "a"}, "geometry": {"type": "Point", "coordinates": [0, 0]}}], f)
+    config = {
+        "history": {"path": str(directory / "history.json"), "derived_metrics": {"D1": "C1 / C2", "D2": "C1 + 2", "D3": "D1 * 2"}},
+        "metadata": {"locations": {"filepath": str(directory / "locations.json")}, "parishes": {"filepath": str(directory / "locations.json")}},
+        "auth": {"database_uri": "sqlite:///" + str(directory / "auth.db"), "secret_key": "test", "email_sender": "test@example.com", "email_password": "", "hash_rounds": 4, "hash_workers": 0},
+    }
+    with open(directory / "config.yml", "w") as f:
+        json.dump(config, f) # JSON is YAML
+    os.environ["ENV"] = "local"
+    os.environ["CONFIG"] = str(directory / "config.yml")
+    sys.path.insert(0, os.path.dirname(BACKEND_DIR))
+    from backend.backend import app
+    return app
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    response = client.post("/auth/login", json={"email": "admin", "password": "admin"})
+    assert response.status_code == 200
+    return client
@@ -0,0 +1,137 @@
+# The asynchronous serving mode (asgi.py) and the connectors' async handlers, against local
+# HTTP servers standing in for InfluxDB and opendatasoft; requires the packages in requirements-asgi.txt
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+import asyncio
+import json
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from connectors import influxdb_history, influxdb_live, opendatasoft_history
+from connectors.common.influxdb_clients import close_async_clients
+from connectors.common.opendatasoft import close_async_session
+
+INFLUXDB_ROWS = [
+    ("2024-01-01T01:00:00Z", "1", "C1", "a"),
+    ("2024-01-01T01:00:00Z", "2", "C2", "a"),
+    ("2024-01-01T02:00:00Z", "3", "C1", "a"),
+    ("2024-01-01T02:00:00Z", "4", "C1", "b"),
+]
+
+def annotated_csv(columns, rows):
+    return "\r\n".join([
+        "#datatype,string,long," + ",".join(datatype for _, datatype in columns),
+        "#group,false,false," + ",".join("false" for _ in columns),
+        "#default,_result,," + "," * (len(columns) - 1),
+        ",result,table," + ",".join(name for name, _ in columns),
+    ] + [",,0," + ",".join(row) for row in rows]) + "\r\n\r\n"
+
+class FakeInfluxDB(BaseHTTPRequestHandler):
+    queries = []
+
+    def do_POST(self):
+        query = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["query"]
+        self.queries.append(query)
+        if 'last(column: "_time")' in query:
+            body = annotated_csv([("_time", "dateTime:RFC3339")], [(INFLUXDB_ROWS[-1][0],)])
+        else:
+            body = annotated_csv([("_time", "dateTime:RFC3339"), ("_value", "double"), ("_field", "string"), ("_measurement", "string")], INFLUXDB_ROWS)
+        self.respond("text/csv", body)
+
+    def respond(self, content_type, body):
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+# two pages of records, linked by "next"
+class FakeOpendatasoft(FakeInfluxDB):
+
+    def do_GET(self):
+        page = 2 if "page=2" in self.path else 1
+        record = lambda hour, location, value: {"record": {"timestamp": f"2024-01-01T0{hour}:05:00Z", "fields": {"time": f"2024-01-01T0{hour}:00:00Z", "id": location, "C1": value}}}
+        if page == 1:
+            res = {"records": [record(1, "a", 1), record(1, "b", 2)], "links": [{"rel": "next", "href": self.server.url + self.path + "&page=2"}]}
+        else:
+            res = {"records": [record(2, "a", 3)], "links": []}
+        self.respond("application/json", json.dumps(res))
+
+@pytest.fixture
+def server(request):
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), request.param)
+    httpd.url = "http://127.0.0.1:{}".format(httpd.server_address[1])
+    thread = Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    request.param.queries = []
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+# runs the coroutine in a new event loop, closing the async clients bound to it
+def run_async(coroutine):
+    async def run():
+        try:
+            return await coroutine
+        finally:
+            await close_async_clients()
+            await close_async_session()
+    return asyncio.run(run())
+
+def influxdb_parameters(server):
+    return {"url": server.url, "token": "token", "org": "org", "bucket": "crowding", "metric_variable": "_field", "location_variable": "_measurement"}
+
+@pytest.mark.parametrize("server", [FakeInfluxDB], indirect=True)
+def test_influxdb_history_async_handler(server):
+    handler = influxdb_history.generate_handler(influxdb_parameters(server))
+    args = {"start": "2024-01-01T00:00:00Z", "end": "2024-01-02T00:00:00Z", "every": "1h", "metrics": "C1,C2"}
+    res = run_async(handler.async_handler(args))
+    assert res == handler(args)
+    assert res == {"timestamps": ["2024-01-01T01:00:00Z", "2024-01-01T02:00:00Z"], "values": {"C1": {"a": [1, 3], "b": [None, 4]}, "C2": {"a": [2, None]}}}
+    assert server.RequestHandlerClass.queries[0] == server.RequestHandlerClass.queries[1]
+
+@pytest.mark.parametrize("server", [FakeInfluxDB], indirect=True)
+def test_influxdb_live_async_handler(server):
+    handler = influxdb_live.generate_handler(dict(influxdb_parameters(server), offset="1d", interval="1h"))
+    args = {"since": "2024-01-01T02:00:00Z"}
+    res = run_async(handler.async_handler(args))
+    assert res == handler(args)
+    assert res["window_start"] == "2023-12-31T02:00:00Z" # last timestamp - offset
+    queries = server.RequestHandlerClass.queries
+    assert queries[:2] == queries[2:]
+
+@pytest.mark.parametrize("server", [FakeOpendatasoft], indirect=True)
+def test_opendatasoft_history_async_handler(server):
+    handler = opendatasoft_history.generate_handler({"url": server.url, "dataset": "crowding", "timestamp_field": "time", "location_field": "id", "metric_fields": ["C1"]})
+    args = {"start": "2024-01-01T00:00:00Z", "end": "2024-01-02T00:00:00Z"}
+    res = run_async(handler.async_handler(args))
+    assert res == handler(args)
+    assert res["values"] == {"C1": {"a": [1, 3], "b": [2, None]}}
+
+async def asgi_get(app, path, query_string=b"", headers=()):
+    messages = [{"type": "http.request", "body": b""}]
+    sent = []
+    async def receive():
+        return messages.pop(0)
+    async def send(message):
+        sent.append(message)
+    scope = {"type": "http", "method": "GET", "path": path, "root_path": "", "query_string": query_string, "headers": list(headers), "http_version": "1.1", "scheme": "http", "server": ("localhost", 80), "client": ("127.0.0.1", 1234)}
+    await app(scope, receive, send)
+    headers = {key.decode(): value.decode() for key, value in sent[0]["headers"]}
+    return sent[0]["status"], headers, b"".join(message.get("body", b"") for message in sent[1:])
+
+# /history (with derived metrics) served in the event loop, as the Flask app serves it
+def test_asgi_data_endpoint(app, client):
+    from backend.asgi import app as asgi_app
+    cookie = "; ".join(f"{cookie.key}={cookie.value}" for cookie in client._cookies.values())
+    query_string = b"metrics=C1,D3"
+    status, headers, body = run_async(asgi_get(asgi_app, "/history", query_string, [(b"cookie", cookie.encode())]))
+    assert status == 200
+    assert json.loads(body) == client.get("/history?" + query_string.decode()).get_json()
+    assert "D3" in json.loads(body)["values"]
+    assert run_async(asgi_get(asgi_app, "/history"))[0] == 401
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+from connectors.common import chunk_cache
+from connectors.common.chunk_cache import ChunkCache, chunked_query, result_size
+from connectors.common.utils import dt_to_string
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+# hourly means labeled with the end of each window, as aggregateWindow labels them
+class HourlyQuery:
+
+    def __init__(self):
+        self.ranges = []
+
+    def __call__(self, start_dt, end_dt):
+        self.ranges.append((start_dt, end_dt))
+        timestamps = []
+        t = start_dt + HOUR
+        while t <= end_dt:
+            timestamps.append(t)
+            t += HOUR
+        return {"timestamps": [dt_to_string(t) for t in timestamps], "values": {"C1": {"a": [t.day * 100 + t.hour for t in timestamps]}}}
+
+def query(cache, query_range, start_dt, end_dt):
+    return chunked_query(cache, ("crowding",), query_range, start_dt, end_dt, HOUR, DAY, 60)
+
+def test_only_missing_chunks_are_queried():
+    cache = ChunkCache(10**9)
+    query_range = HourlyQuery()
+    start_dt = datetime(2024, 1, 1)
+    assert query(cache, query_range, start_dt, start_dt + 2 * DAY) == HourlyQuery()(start_dt, start_dt + 2 * DAY)
+    assert query_range.ranges == [(start_dt, start_dt + 2 * DAY)]
+    # overlapping the cached days, and starting within the first one
+    res = query(cache, query_range, start_dt + 12 * HOUR, start_dt + 3 * DAY)
+    assert res == HourlyQuery()(start_dt + 12 * HOUR, start_dt + 3 * DAY)
+    assert query_range.ranges[1:] == [(start_dt + 2 * DAY, start_dt + 3 * DAY)]
+    # the results in the cache are not modified by the merge
+    assert query(cache, query_range, start_dt, start_dt + DAY) == HourlyQuery()(start_dt, start_dt + DAY)
+    assert len(query_range.ranges) == 2
+
+def test_consecutive_missing_chunks_are_queried_together():
+    cache = ChunkCache(10**9)
+    query_range = HourlyQuery()
+    start_dt = datetime(2024, 1, 1)
+    query(cache, query_range, start_dt + 2 * DAY, start_dt + 3 * DAY)
+    res = query(cache, query_range, start_dt, start_dt + 5 * DAY)
+    assert res == HourlyQuery()(start_dt, start_dt + 5 * DAY)
+    assert query_range.ranges[1:] == [(start_dt, start_dt + 2 * DAY), (start_dt + 3 * DAY, start_dt + 5 * DAY)]
+
+# raw results hold the timestamps c <= t < c + chunk of each chunk
+def test_raw_results():
+    cache = ChunkCache(10**9)
+    def raw_query(start_dt, end_dt):
+        return HourlyQuery()(start_dt - HOUR, end_dt - HOUR) # start_dt <= t < end_dt
+    start_dt = datetime(2024, 1, 1)
+    res = chunked_query(cache, ("crowding",), raw_query, start_dt, start_dt + 2 * DAY, None, DAY, 60)
+    assert res["timestamps"][0] == "2024-01-01T00:00:00Z"
+    assert res["timestamps"][-1] == "2024-01-02T23:00:00Z"
+    assert len(res["timestamps"]) == 48
+
+def test_least_recently_used_chunks_are_evicted():
+    res = {"timestamps": ["2024-01-01T01:00:00Z"], "values": {"C1": {"a": [1]}}}
+    cache = ChunkCache(2 * result_size(res))
+    cache.put("a", res)
+    cache.put("b", res)
+    assert cache.get("a") is res # now more recently used than b
+    cache.put("c", res)
+    assert cache.get("b") is None
+    assert cache.get("a") is res and cache.get("c") is res
+    assert cache.size == 2 * result_size(res)
+
+def test_open_chunk_expires(monkeypatch):
+    now = [1000]
+    monkeypatch.setattr(chunk_cache, "monotonic", lambda: now[0])
+    cache = ChunkCache(10**9)
+    query_range = HourlyQuery()
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    query(cache, query_range, today - DAY, today + DAY)
+    query(cache, query_range, today - DAY, today + DAY)
+    assert len(query_range.ranges) == 1
+    now[0] += 61
+    query(cache, query_range, today - DAY, today + DAY)
+    assert query_range.ranges[1:] == [(today, today + DAY)] # the closed chunk is kept
+
+def test_counts_chunk_hits_and_misses():
+    cache = ChunkCache(10**9)
+    start_dt = datetime(2024, 1, 1)
+    query(cache, HourlyQuery(), start_dt, start_dt + 2 * DAY)
+    query(cache, HourlyQuery(), start_dt + DAY, start_dt + 3 * DAY)
+    assert (cache.hits, cache.misses) == (1, 3)
@@ -0,0 +1,23 @@
+from timeseries_format import MIMETYPE
+
+SCALARS = {"timestamps": ["2024-01-01T01:00:00Z"], "values": {"C1": {"a": [1]}}, "version": "v1"}
+QUARTILES = {"timestamps": ["2024-01-01T01:00:00Z"], "values": {"C1": {"a": [[1, 2, 3]]}}, "version": "v1"}
+
+def respond(app, res, headers):
+    from backend.backend import data_response
+    with app.test_request_context(headers=headers):
+        return data_response(res, False)
+
+def test_versioned_binary_response(app):
+    response = respond(app, SCALARS, {"Accept": MIMETYPE})
+    assert response.mimetype == MIMETYPE
+    assert response.headers["ETag"] == '"v1-binary"'
+    assert respond(app, SCALARS, {"Accept": MIMETYPE, "If-None-Match": '"v1-binary"'}).status_code == 304
+    assert respond(app, SCALARS, {"If-None-Match": '"v1-binary"'}).status_code == 200
+
+# results the binary format can't encode are sent as JSON, and revalidated as such
+def test_versioned_json_fallback(app):
+    response = respond(app, QUARTILES, {"Accept": MIMETYPE})
+    assert response.mimetype == "application/json"
+    assert response.headers["ETag"] == '"v1-json"'
+    assert respond(app, QUARTILES, {"Accept": MIMETYPE, "If-None-Match": '"v1-json"'}).status_code == 304
@@ -0,0 +1,13 @@
+from conftest import HISTORY
+
+def test_selected_metrics_dont_change_later_responses(client):
+    response = client.get("/history?metrics=D2")
+    assert response.json["values"] == {"D2": {"a": [3, 4]}}
+    response = client.get("/history")
+    assert set(response.json["values"]) == {"C1", "C2", "D1", "D2", "D3"}
+    assert response.json["values"]["C1"] == HISTORY["values"]["C1"]
+
+def test_derived_metrics_are_computed_on_each_request(client):
+    for _ in range(2):
+        response = client.get("/history?metrics=D3,C2")
+        assert response.json["values"] == {"D3": {"a": [1.0, 1.0]}, "C2": {"a": [2, 4]}}
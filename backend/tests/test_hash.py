@@ -0,0 +1,38 @@
+from multiprocessing import forkserver, spawn
+import shutil
+import sys
+import hash
+
+def test_calibrate_stays_within_target(monkeypatch):
+    times = iter([0, 0.1]) # 100ms at 10 rounds
+    monkeypatch.setattr(hash, "perf_counter", lambda: next(times))
+    monkeypatch.setattr(hash, "hashpw", lambda pwd, rounds: None)
+    assert hash.calibrate(250) == 11 # 200ms; 12 rounds would take 400ms
+
+def test_hashes_in_pool(monkeypatch):
+    monkeypatch.setitem(hash.options, "rounds", 4)
+    monkeypatch.setitem(hash.options, "workers", 1)
+    try:
+        pwd_hash = hash.gen_hash("secret")
+        assert hash.check_hash("secret", pwd_hash)
+        assert not hash.check_hash("other", pwd_hash)
+    finally:
+        if hash.pool["executor"] is not None:
+            hash.pool["executor"].shutdown()
+        hash.forget_pool()
+
+# as under uWSGI, whose sys.executable is the uwsgi binary
+def test_hashes_in_pool_when_executable_isnt_python(monkeypatch):
+    forkserver._forkserver._stop() # started again by the pool
+    # multiprocessing reads sys.executable when it's imported
+    monkeypatch.setattr(sys, "executable", shutil.which("true"))
+    monkeypatch.setattr(spawn, "_python_exe", sys.executable)
+    monkeypatch.setitem(hash.options, "rounds", 4)
+    monkeypatch.setitem(hash.options, "workers", 1)
+    try:
+        assert hash.check_hash("secret", hash.gen_hash("secret"))
+    finally:
+        if hash.pool["executor"] is not None:
+            hash.pool["executor"].shutdown()
+        hash.forget_pool()
+        forkserver._forkserver._stop()
@@ -0,0 +1,21 @@
+from types import SimpleNamespace
+import importlib.util
+import os
+import sys
+from conftest import BACKEND_DIR
+
+# a separate copy of the module, imported as in a uWSGI worker
+def import_in_uwsgi(monkeypatch, uwsgi):
+    monkeypatch.setitem(sys.modules, "uwsgi", uwsgi)
+    spec = importlib.util.spec_from_file_location("uwsgi_influxdb_clients", os.path.join(BACKEND_DIR, "connectors", "common", "influxdb_clients.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_uwsgi_atexit_is_chained(monkeypatch):
+    called = []
+    uwsgi = SimpleNamespace(atexit=lambda: called.append("previous"))
+    module = import_in_uwsgi(monkeypatch, uwsgi)
+    monkeypatch.setattr(module, "close_clients", lambda: called.append("close_clients"))
+    uwsgi.atexit()
+    assert called == ["close_clients", "previous"]
@@ -0,0 +1,23 @@
+from datetime import datetime
+from types import SimpleNamespace
+from connectors.common.assembly import assemble
+from connectors.common.influxdb_columnar import read_columns, pivot
+
+HEADER = ["", "result", "table", "_time", "_value", "_field", "_measurement"]
+ROWS = [
+    ("2024-01-01T00:00:00Z", "1", "C1", "a"),
+    ("2024-01-01T00:00:01.5Z", "2", "C1", "a"),
+    ("2024-01-01T00:00:02Z", "", "C1", "b"),
+    ("2024-01-01T00:00:02Z", "3", "C2", "a"),
+]
+
+def record(time, value, metric, location):
+    dt = datetime.fromisoformat(time.replace("Z", "+00:00"))
+    return SimpleNamespace(values={"_time": dt, "_value": float(value) if value else None, "_field": metric, "_measurement": location})
+
+# the columnar engine's result is the records engine's
+def test_same_result_as_records_engine():
+    rows = [HEADER] + [["", "_result", "0", *row] for row in ROWS]
+    res = pivot(*read_columns(rows, "_measurement", "_field"), "_field")
+    assert res == assemble([record(*row) for row in ROWS], "_measurement", "_field")
+    assert res["timestamps"] == ["2024-01-01T00:00:00Z", "2024-01-01T00:00:01.500000Z", "2024-01-01T00:00:02Z"]
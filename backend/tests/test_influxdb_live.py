@@ -0,0 +1,41 @@
+from connectors import influxdb_live
+
+PARAMETERS = {"url": "http://influxdb", "token": "token", "org": "org", "bucket": "crowding", "metric_variable": "_field", "location_variable": "_measurement", "offset": "3h", "interval": "1h"}
+# windows ending at each hour, and the open one labeled with the time of the query
+LABELS = ["2024-01-01T11:00:00Z", "2024-01-01T12:00:00Z", "2024-01-01T12:34:56Z"]
+
+def fake_influxdb(monkeypatch, labels):
+    starts = []
+    def query(url, token, org, bucket, start, end, location_variable, metric_variable, every, locations, filters):
+        starts.append(start)
+        timestamps = [t for t in labels if t.replace("Z", "+00:00") > start]
+        return {"timestamps": timestamps, "values": {"C1": {"a": [labels.index(t) for t in timestamps]}}}
+    monkeypatch.setattr(influxdb_live, "query", query)
+    monkeypatch.setattr(influxdb_live, "query_last_timestamp", lambda *args: "2024-01-01T12:30:00Z")
+    return starts
+
+# since is the label of the window that was still open: it's queried again from its start
+def test_since_an_unaligned_label(monkeypatch):
+    starts = fake_influxdb(monkeypatch, LABELS)
+    handler = influxdb_live.generate_handler(PARAMETERS)
+    res = handler({"since": "2024-01-01T12:34:56Z"})
+    assert starts == ["2024-01-01T12:00:00+00:00"]
+    assert res["replace_from"] == "2024-01-01T12:00:00Z"
+    assert res["timestamps"] == ["2024-01-01T12:34:56Z"]
+    assert res["window_start"] == "2024-01-01T09:30:00Z"
+
+def test_since_an_aligned_label(monkeypatch):
+    starts = fake_influxdb(monkeypatch, LABELS)
+    res = influxdb_live.generate_handler(PARAMETERS)({"since": "2024-01-01T12:00:00Z"})
+    assert starts == ["2024-01-01T11:00:00+00:00"]
+    assert res["replace_from"] == "2024-01-01T11:00:00Z"
+    assert res["timestamps"] == ["2024-01-01T12:00:00Z", "2024-01-01T12:34:56Z"]
+
+# the snapshot no longer has the label the client has: it's replaced by the newer windows
+def test_snapshot_since_an_old_unaligned_label(monkeypatch):
+    fake_influxdb(monkeypatch, LABELS[:2] + ["2024-01-01T13:00:00Z", "2024-01-01T13:05:00Z"])
+    handler = influxdb_live.generate_handler(dict(PARAMETERS, refresh_interval=3600))
+    res = handler({"since": "2024-01-01T12:34:56Z"})
+    assert res["replace_from"] == "2024-01-01T12:00:00Z"
+    assert res["timestamps"] == ["2024-01-01T13:00:00Z", "2024-01-01T13:05:00Z"]
+    assert res["window_start"] == "2024-01-01T11:00:00Z"
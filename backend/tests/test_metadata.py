@@ -0,0 +1,14 @@
+import hashlib
+import json
+
+def test_etag_covers_the_configuration(app, client):
+    response = client.get("/metadata")
+    body = response.get_data()
+    assert json.loads(body)["locations"][0]["properties"]["id"] == "a"
+    assert response.headers["ETag"] == '"{}"'.format(hashlib.sha256(body).hexdigest()[:32])
+
+def test_not_modified(client):
+    etag = client.get("/metadata", headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+    assert etag.endswith('-gzip"')
+    assert client.get("/metadata", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}).status_code == 304
+    assert client.get("/metadata", headers={"If-None-Match": etag}).status_code == 200
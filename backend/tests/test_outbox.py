@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+from send_email import make_message
+
+class FailingTransport:
+
+    def open(self):
+        raise OSError("connection refused")
+
+class RecordingTransport:
+
+    def __init__(self):
+        self.sent = []
+
+    def open(self):
+        return self
+
+    def sendmail(self, sender, recipient, message):
+        self.sent.append((sender, recipient, message))
+
+    def close(self):
+        pass
+
+def test_delivers_the_email_format(app, monkeypatch):
+    from backend.backend import outbox, db
+    transport = RecordingTransport()
+    monkeypatch.setattr(outbox, "transport", transport) # also used by the app's sender thread, if it runs now
+    with app.app_context():
+        outbox.enqueue("user@example.com", "subject", "body")
+        db.session.commit()
+        outbox.deliver_batch()
+        assert emails(db, "user@example.com")[0][0] == ""
+    assert transport.sent == [("test@example.com", "user@example.com", make_message("subject", "body", "test@example.com", "user@example.com"))]
+
+# (body, next_attempt) of the emails to the recipient
+def emails(db, recipient):
+    from backend.db_model import Email
+    return [(email.body, email.next_attempt) for email in db.session.scalars(db.select(Email).where(Email.recipient == recipient))]
+
+# bodies may contain activation links, which must not stay in the database
+def test_given_up_email_body_is_blanked(app, monkeypatch):
+    from backend.backend import outbox, db
+    monkeypatch.setattr(outbox, "transport", FailingTransport())
+    monkeypatch.setattr(outbox, "max_attempts", 1)
+    with app.app_context():
+        outbox.enqueue("failing@example.com", "subject", "secret link")
+        db.session.commit()
+        outbox.deliver_batch()
+        assert emails(db, "failing@example.com") == [("", None)]
+
+def test_old_unsent_email_expires(app, monkeypatch):
+    from backend.backend import outbox, db
+    from backend.db_model import Email
+    monkeypatch.setattr(outbox, "transport", FailingTransport())
+    with app.app_context():
+        created = datetime.now() - timedelta(days=2)
+        db.session.add(Email(recipient="old@example.com", subject="subject", body="secret link", created=created, attempts=3, next_attempt=datetime.now() + timedelta(hours=1)))
+        outbox.enqueue("new@example.com", "subject", "secret link")
+        db.session.commit()
+        outbox.expire()
+        assert emails(db, "old@example.com") == [("", None)]
+        assert emails(db, "new@example.com")[0][0] == "secret link"
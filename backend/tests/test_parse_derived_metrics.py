@@ -0,0 +1,75 @@
+import pytest
+from parse_derived_metrics import compile_derived_metrics, add_derived_metrics
+
+def result(values, length):
+    return {"timestamps": ["2024-01-01T0{}:00:00Z".format(i) for i in range(length)], "values": values}
+
+def test_prediction_quartiles_are_computed_separately():
+    # real values followed by predicted quartiles, as prepared by forecasting/polling_job.py
+    plan = compile_derived_metrics({"D": "T * 2", "E": "T / R"})
+    res = result({"T": {"a": [1, None, [1, 2, 3, 4, 5]]}, "R": {"a": [1, 2, 2]}}, 3)
+    res = add_derived_metrics(res, plan)
+    assert res["values"]["D"] == {"a": [2, None, [2, 4, 6, 8, 10]]}
+    assert res["values"]["E"] == {"a": [1, None, [0.5, 1, 1.5, 2, 2.5]]}
+
+def test_only_quartile_series():
+    plan = compile_derived_metrics({"D": "T + 1"})
+    res = add_derived_metrics(result({"T": {"a": [[1, 2], [3, None]]}}, 2), plan)
+    assert res["values"]["D"] == {"a": [[2, 3], [4, None]]}
+
+def test_scalar_metric_next_to_quartiles_stays_scalar():
+    plan = compile_derived_metrics({"D": "T + 1", "E": "R + 1"})
+    res = add_derived_metrics(result({"T": {"a": [1, [1, 2]]}, "R": {"a": [1, 2]}}, 2), plan)
+    assert res["values"]["D"] == {"a": [2, [2, 3]]}
+    assert res["values"]["E"] == {"a": [2, 3]}
+
+DERIVED_METRICS = {"RATIO": "C1 / (C2 + C3)", "TOTAL": "(C2 + C3) * 2", "PERCENT": "RATIO * 100"}
+BASE = {"C1": {"a": [1, 2, None], "b": [4, 4, 4]}, "C2": {"a": [1, 0, 1], "b": [1, 1, 1]}, "C3": {"a": [1, 0, 1]}}
+
+def test_shared_subexpressions_are_compiled_once():
+    plan = compile_derived_metrics(DERIVED_METRICS)
+    assert [step for step in plan.steps if step[0] == "+"] == [("+", (plan.step_indexes[("metric", "C2")], plan.step_indexes[("metric", "C3")]))]
+    assert sum(1 for step in plan.steps if step == ("metric", "C1")) == 1
+
+def test_constants_are_folded():
+    plan = compile_derived_metrics({"D": "C1 * (2 + 3)"})
+    assert ("*", (plan.step_indexes[("metric", "C1")], plan.step_indexes[("constant", 5.0)])) in plan.steps
+    assert not any(step[0] == "+" for step in plan.steps)
+
+def test_requirements_of_derived_on_derived():
+    plan = compile_derived_metrics(DERIVED_METRICS)
+    assert plan.requirements(["PERCENT"]) == (["C1", "C2", "C3"], ["PERCENT"])
+    assert plan.requirements(["TOTAL", "C4"]) == (["C2", "C3", "C4"], ["TOTAL"])
+
+def test_evaluates_the_requested_metrics():
+    plan = compile_derived_metrics(DERIVED_METRICS)
+    values = add_derived_metrics(result(BASE, 3), plan)["values"]
+    # null operands and divisions by zero are null; b has no C3, so it has no derived metric using it
+    assert values["RATIO"] == {"a": [0.5, None, None]}
+    assert values["TOTAL"] == {"a": [4, 0, 4]}
+    assert values["PERCENT"] == {"a": [50, None, None]}
+    # only the requested metrics are computed, from the base metrics they need
+    values = add_derived_metrics(result({"C2": BASE["C2"], "C3": BASE["C3"]}, 3), plan, ["TOTAL"])["values"]
+    assert set(values) == {"C2", "C3", "TOTAL"}
+
+# a derived metric named after a base metric replaces it, and other derived metrics reference it
+def test_derived_metric_replacing_a_base_metric():
+    plan = compile_derived_metrics({"C1": "C1 * 2", "D": "C1 + 1"})
+    assert plan.requirements(["D"]) == (["C1"], ["D"])
+    values = add_derived_metrics(result({"C1": {"a": [1, None]}}, 2), plan)["values"]
+    assert values == {"C1": {"a": [2, None]}, "D": {"a": [3, None]}}
+
+def test_result_is_not_modified():
+    plan = compile_derived_metrics(DERIVED_METRICS)
+    res = result(BASE, 3)
+    first = add_derived_metrics(res, plan, ["PERCENT"])
+    assert res == result(BASE, 3)
+    assert add_derived_metrics(res, plan, ["PERCENT"]) == first
+
+def test_constant_expression():
+    plan = compile_derived_metrics({"ONE": "1"})
+    assert add_derived_metrics(result({"C1": {"a": [1, 2]}}, 2), plan)["values"]["ONE"] == {"a": [1, 1]}
+
+def test_circular_references_are_rejected():
+    with pytest.raises(ValueError, match="circular"):
+        compile_derived_metrics({"A": "B + 1", "B": "A * 2"})
@@ -0,0 +1,53 @@
+import subprocess
+import sys
+import pytest
+from conftest import BACKEND_DIR
+from profiler import SamplingProfiler
+
+def busy():
+    total = 0
+    for i in range(3000000):
+        total += i * i
+    return total
+
+def test_samples_cpu_bound_work():
+    profiler = SamplingProfiler(0.001)
+    profiler.start()
+    busy()
+    profiler.stop()
+    assert sum(profiler.stacks.values()) > 0
+    assert "busy (test_profiler.py" in profiler.folded()
+
+# as under uWSGI with --gevent-monkey-patch, where each request is a greenlet; monkey-patching
+# this process would affect the other tests, so it runs in its own
+GEVENT_SCRIPT = """
+from gevent import monkey
+monkey.patch_all()
+import gevent
+from profiler import SamplingProfiler
+
+def busy():
+    total = 0
+    for i in range(3000000):
+        total += i * i
+    return total
+
+def request():
+    profiler = SamplingProfiler(0.001)
+    profiler.start()
+    gevent.sleep(0.05) # waiting, e.g. for a query
+    busy()
+    profiler.stop()
+    return profiler
+
+profiler = gevent.spawn(request).get()
+folded = profiler.folded()
+assert sum(profiler.stacks.values()) > 0, "no samples"
+assert "busy (<string>" in folded, folded
+assert "request (<string>" in folded, folded
+"""
+
+def test_samples_cpu_bound_greenlet_under_gevent():
+    pytest.importorskip("gevent")
+    result = subprocess.run([sys.executable, "-c", GEVENT_SCRIPT], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
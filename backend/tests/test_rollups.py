@@ -0,0 +1,28 @@
+from datetime import datetime, timezone
+from connectors.common.influxdb import parse_rollups, select_bucket
+
+ROLLUPS = parse_rollups([{"bucket": "hourly", "every": "1h", "offset": "5m"}, {"bucket": "daily", "every": "1d"}])
+NOW = datetime(2024, 1, 10, 12, 30, tzinfo=timezone.utc)
+
+def test_closed_aligned_range_uses_the_coarsest_rollup():
+    assert select_bucket("raw", ROLLUPS, "2024-01-01T00:00:00Z", "2024-01-03T00:00:00Z", "1d", NOW) == \
+        ("daily", "2024-01-02T00:00:00+00:00", "2024-01-04T00:00:00+00:00", "1d")
+    assert select_bucket("raw", ROLLUPS, "2024-01-01T10:00:00Z", "2024-01-01T14:00:00Z", "2h", NOW) == \
+        ("hourly", "2024-01-01T11:00:00+00:00", "2024-01-01T15:00:00+00:00", "1h")
+
+def test_open_range_uses_the_raw_bucket():
+    # e.g. the live connector's range since the last window
+    assert select_bucket("raw", ROLLUPS, "2024-01-10T10:00:00Z", None, "1h", NOW) == ("raw", "2024-01-10T10:00:00Z", None, None)
+
+def test_range_reaching_an_unwritten_interval_uses_the_raw_bucket():
+    # 11:00-12:00 was written at 12:05
+    assert select_bucket("raw", ROLLUPS, "2024-01-10T10:00:00Z", "2024-01-10T12:00:00Z", "1h", NOW)[0] == "hourly"
+    assert select_bucket("raw", ROLLUPS, "2024-01-10T10:00:00Z", "2024-01-10T13:00:00Z", "1h", NOW)[0] == "raw"
+    early = datetime(2024, 1, 10, 12, 3, tzinfo=timezone.utc)
+    assert select_bucket("raw", ROLLUPS, "2024-01-10T10:00:00Z", "2024-01-10T12:00:00Z", "1h", early)[0] == "raw"
+    # today's daily interval is still open
+    assert select_bucket("raw", ROLLUPS, "2024-01-09T00:00:00Z", "2024-01-11T00:00:00Z", "1d", NOW)[0] == "raw"
+    assert select_bucket("raw", ROLLUPS, "2024-01-09T00:00:00Z", "2024-01-10T00:00:00Z", "1d", NOW)[0] == "daily"
+
+def test_unaligned_range_uses_the_raw_bucket():
+    assert select_bucket("raw", ROLLUPS, "2024-01-01T10:30:00Z", "2024-01-01T14:30:00Z", "1h", NOW)[0] == "raw"
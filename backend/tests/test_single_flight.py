@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from time import sleep
+import asyncio
+import pytest
+from werkzeug.datastructures import MultiDict
+from single_flight import SingleFlight, args_key
+
+# waits until n calls have entered the flight
+def wait_for_requests(flight, n):
+    for _ in range(1000):
+        if flight.requests >= n:
+            return
+        sleep(0.005)
+    raise AssertionError("calls did not start")
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    release = Event()
+    calls = []
+    def f():
+        calls.append(1)
+        release.wait()
+        return {"result": len(calls)}
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(flight.do, "key", f) for _ in range(4)]
+        wait_for_requests(flight, 4)
+        release.set()
+        results = [future.result() for future in futures]
+    assert calls == [1]
+    assert all(result is results[0] for result in results)
+    assert flight.coalesced == 3
+    assert flight.calls == {}
+
+def test_error_is_shared_and_not_kept():
+    flight = SingleFlight()
+    release = Event()
+    def f():
+        release.wait()
+        raise ValueError("query failed")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(flight.do, "key", f) for _ in range(2)]
+        wait_for_requests(flight, 2)
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result()
+    assert flight.do("key", lambda: 1) == 1 # a later call runs again
+
+def test_sequential_calls_and_other_keys_are_not_coalesced():
+    flight = SingleFlight()
+    assert [flight.do("a", lambda: 1), flight.do("a", lambda: 2), flight.do("b", lambda: 3)] == [1, 2, 3]
+    assert flight.coalesced == 0
+
+def test_async_calls_share_one_result():
+    flight = SingleFlight()
+    calls = []
+    async def f():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"result": len(calls)}
+    async def run():
+        return await asyncio.gather(*(flight.do_async("key", f) for _ in range(3)), flight.do_async("other", f))
+    results = asyncio.run(run())
+    assert len(calls) == 2
+    assert results[0] is results[1] is results[2]
+    assert results[3] is not results[0]
+    assert flight.coalesced == 2
+    assert flight.async_calls == {}
+
+def test_args_key_ignores_order():
+    assert args_key(MultiDict([("start", "1"), ("metrics", "C1")])) == args_key(MultiDict([("metrics", "C1"), ("start", "1")]))
+    assert args_key(MultiDict([("metrics", "C1")])) != args_key(MultiDict([("metrics", "C2")]))
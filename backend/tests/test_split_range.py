@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+from connectors import influxdb_history
+from connectors.common import influxdb
+from connectors.common.data import merge_results
+from connectors.common.utils import split_range, parse_date, dt_to_string
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+def test_inner_bounds_are_aligned():
+    start_dt, end_dt = datetime(2024, 1, 1, 10, 30), datetime(2024, 3, 1, 5)
+    ranges = split_range(start_dt, end_dt, DAY, 4)
+    assert len(ranges) == 4
+    assert ranges[0][0] == start_dt and ranges[-1][1] == end_dt
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    assert all(end == end.replace(hour=0, minute=0) for _, end in ranges[:-1])
+
+def test_short_range_is_not_split_below_every():
+    assert split_range(datetime(2024, 1, 1), datetime(2024, 1, 1, 3), HOUR, 8) == [
+        (datetime(2024, 1, 1), datetime(2024, 1, 1, 1)),
+        (datetime(2024, 1, 1, 1), datetime(2024, 1, 1, 2)),
+        (datetime(2024, 1, 1, 2), datetime(2024, 1, 1, 3)),
+    ]
+
+# hourly means over [start, end), labeled with the end of each window; location b only has even hours
+def hourly_query(url, token, org, bucket, start, end, location_variable, metric_variable, every, locations, filters, rollups, derived):
+    timestamps = []
+    t = parse_date(start) + HOUR
+    while t <= parse_date(end):
+        timestamps.append(t)
+        t += HOUR
+    values = {"a": [t.hour for t in timestamps], "b": [t.hour if t.hour % 2 == 0 else None for t in timestamps]}
+    return {"timestamps": [dt_to_string(t) for t in timestamps], "values": {"C1": values}}
+
+def test_split_query_is_merged_in_order(monkeypatch):
+    ranges = []
+    def query(*args):
+        ranges.append((args[4], args[5]))
+        return hourly_query(*args)
+    monkeypatch.setattr(influxdb, "query", query)
+    parameters = {"url": "http://influxdb", "token": "token", "org": "org", "bucket": "crowding", "metric_variable": "_field", "location_variable": "_measurement"}
+    handler = influxdb_history.generate_handler(dict(parameters, split={"threshold": "1d", "max_workers": 3}))
+    args = {"start": "2024-01-01T00:00:00Z", "end": "2024-01-04T00:00:00Z", "every": "1h"}
+    res = handler(args)
+    assert ranges == [("2024-01-01T00:00:00Z", "2024-01-02T00:00:00Z"), ("2024-01-02T00:00:00Z", "2024-01-03T00:00:00Z"), ("2024-01-03T00:00:00Z", "2024-01-04T00:00:00Z")]
+    assert res == hourly_query(*[None] * 4, args["start"], args["end"], *[None] * 7)
+    assert len(res["timestamps"]) == 72
+
+def test_merge_of_disjoint_locations():
+    first = {"timestamps": ["t1", "t2"], "values": {"C1": {"a": [1, 2]}}}
+    second = {"timestamps": ["t2", "t3"], "values": {"C1": {"b": [3, 4]}, "C2": {"a": [5, 6]}}}
+    assert merge_results([first, second]) == {"timestamps": ["t1", "t2", "t3"], "values": {"C1": {"a": [1, 2, None], "b": [None, 3, 4]}, "C2": {"a": [None, 5, 6]}}}
+    assert first == {"timestamps": ["t1", "t2"], "values": {"C1": {"a": [1, 2]}}}
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta, timezone
+import json
+import struct
+import numpy as np
+from timeseries_format import encode, MAGIC
+
+# reads the encoded result back, as the frontend does (see decodeTimeseries in Utils.js)
+def decode(data):
+    assert data[:4] == MAGIC
+    header_length, = struct.unpack_from("<I", data, 4)
+    assert header_length % 4 == 0
+    header = json.loads(data[8:8 + header_length])
+    length = header["length"]
+    if "timestamps" in header:
+        timestamps = header["timestamps"]
+    else:
+        start = datetime.fromisoformat(header["start"].replace("Z", "+00:00"))
+        timestamps = [(start + timedelta(seconds=header["step"] * i)).strftime("%Y-%m-%dT%H:%M:%SZ") for i in range(length)]
+    offset = 8 + header_length
+    floats = np.frombuffer(data, "<f4", len(header["series"]) * length, offset).reshape(len(header["series"]), length)
+    offset += floats.nbytes
+    bitmap_length = -(-length // 8)
+    assert len(data) == offset + len(header["series"]) * bitmap_length
+    values = {}
+    for i, (metric, location_index) in enumerate(header["series"]):
+        bitmap = np.frombuffer(data, np.uint8, bitmap_length, offset + i * bitmap_length)
+        present = np.unpackbits(bitmap, count=length, bitorder="little").astype(bool)
+        location_values = [float(v) if p else None for v, p in zip(floats[i], present)]
+        location = header["locations"][location_index]
+        if metric is None:
+            values[location] = location_values
+        else:
+            values.setdefault(metric, {})[location] = location_values
+    return dict(header["extra"], timestamps=timestamps, values=values), header
+
+def test_round_trip_with_regular_timestamps():
+    res = {
+        "timestamps": ["2024-01-01T01:00:00Z", "2024-01-01T02:00:00Z", "2024-01-01T03:00:00Z"],
+        "values": {"C1": {"a": [1.5, None, 3], "b": [None, None, 0]}, "C2": {"a": [-2, 4, None]}},
+        "version": "v1",
+    }
+    decoded, header = decode(encode(res))
+    assert decoded == res
+    assert "timestamps" not in header and header["step"] == 3600
+    assert header["locations"] == ["a", "b"]
+
+def test_round_trip_without_metric_level():
+    res = {"timestamps": ["2024-01-01T01:00:00Z"], "values": {"a": [1], "b": [None]}}
+    decoded, header = decode(encode(res))
+    assert decoded == res
+    assert header["series"] == [[None, 0], [None, 1]]
+
+# irregular or fractional timestamps are sent as they are
+def test_timestamps_kept_when_not_regular():
+    for timestamps in (["2024-01-01T01:00:00Z", "2024-01-01T02:00:00Z", "2024-01-01T04:00:00Z"], ["2024-01-01T01:00:00.500000Z", "2024-01-01T02:00:00.500000Z", "2024-01-01T03:00:00.500000Z"]):
+        res = {"timestamps": timestamps, "values": {"C1": {"a": [1, 2, 3]}}}
+        decoded, header = decode(encode(res))
+        assert header["timestamps"] == timestamps
+        assert decoded == res
+
+def test_bitmap_spans_several_bytes():
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    timestamps = [(start + timedelta(minutes=15 * i)).strftime("%Y-%m-%dT%H:%M:%SZ") for i in range(11)]
+    res = {"timestamps": timestamps, "values": {"C1": {"a": [i if i % 3 else None for i in range(11)]}}}
+    assert decode(encode(res))[0] == res
+
+def test_results_that_cant_be_encoded():
+    assert encode({"timestamps": ["2024-01-01T01:00:00Z"], "values": {"C1": {"a": [[1, 2, 3]]}}}) is None # quartiles
+    assert encode({"timestamps": ["2024-01-01T01:00:00Z"], "values": {"C1": {"a": [1, 2]}}}) is None # ragged
+    assert encode({"locations": []}) is None
@@ -0,0 +1,68 @@
+# Compact binary encoding of {"timestamps": [...], "values": {metric: {location: [...]}}} results,
+# offered to clients that send "Accept: application/vnd.crowding.timeseries".
+#
+# Layout (little-endian):
+#   "CVTS" | uint32 header length | JSON header, padded with spaces to a multiple of 4 bytes
+#   float32[length] for each series, in header order (NaN where the value is null)
+#   null bitmap for each series, ceil(length / 8) bytes (bit i set = value i present, LSB first)
+# The header holds "length", either "start" and "step" (seconds) for regular timestamps or
+# "timestamps", the interned "locations", "series" as [metric, location index] pairs (metric
+# is null when the result has no metric level) and the remaining top-level keys in "extra".
+import json
+import struct
+from datetime import datetime
+import numpy as np
+
+MIMETYPE = "application/vnd.crowding.timeseries"
+MAGIC = b"CVTS"
+
+def timestamps_header(timestamps):
+    if len(timestamps) < 2:
+        return {"timestamps": timestamps}
+    # only whole-second UTC timestamps, which clients can regenerate with the same formatting
+    if any("." in t or not t.endswith("Z") for t in timestamps):
+        return {"timestamps": timestamps}
+    try:
+        seconds = [int(datetime.fromisoformat(t.replace("Z", "+00:00")).timestamp()) for t in timestamps]
+    except ValueError:
+        return {"timestamps": timestamps}
+    step = seconds[1] - seconds[0]
+    if any(b - a != step for a, b in zip(seconds, seconds[1:])):
+        return {"timestamps": timestamps}
+    return {"start": timestamps[0], "step": step}
+
+def series_list(values):
+    for key, value in values.items():
+        if isinstance(value, dict):
+            for location, location_values in value.items():
+                yield key, location, location_values
+        else:
+            yield None, key, value
+
+# returns the encoded result, or None if it can't be represented (e.g. prediction quartiles)
+def encode(res):
+    if not isinstance(res, dict) or "timestamps" not in res or "values" not in res:
+        return None
+    length = len(res["timestamps"])
+    locations = {} # maps location to its index
+    series = []
+    floats = []
+    bitmaps = []
+    for metric, location, location_values in series_list(res["values"]):
+        try:
+            arr = np.array(location_values, dtype=np.float64) # None becomes NaN
+        except (TypeError, ValueError): # nested values, e.g. quartiles
+            return None
+        if arr.shape != (length,):
+            return None
+        series.append([metric, locations.setdefault(location, len(locations))])
+        floats.append(arr.astype("<f4").tobytes())
+        bitmaps.append(np.packbits(~np.isnan(arr), bitorder="little").tobytes())
+    header = timestamps_header(res["timestamps"])
+    header["length"] = length
+    header["locations"] = list(locations)
+    header["series"] = series
+    header["extra"] = {k: v for k, v in res.items() if k not in ("timestamps", "values")}
+    header_bytes = json.dumps(header).encode()
+    header_bytes += b" " * (-len(header_bytes) % 4)
+    return b"".join([MAGIC, struct.pack("<I", len(header_bytes)), header_bytes] + floats + bitmaps)
@@ -0,0 +1,39 @@
+# Bounded in-process cache whose entries expire after a fixed time; least recently used
+# entries are evicted first when it's full. Keeps hit and miss counters.
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+class TTLCache:
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl # seconds
+        self.entries = OrderedDict() # key -> (expiration time, value)
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # returns None if the key isn't cached or has expired
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= monotonic():
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def remove(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
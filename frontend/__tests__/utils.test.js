@@ -1,6 +1,6 @@
 const { expect, test } = require('@jest/globals');
 
-import { concatDataIndexes, nextLocalMaxIndex } from 'Utils';
+import { concatDataIndexes, nextLocalMaxIndex, mergeLiveDelta, decodeTimeseries } from 'Utils';
 
 test("concatDataIndexes test", () => {
     expect(concatDataIndexes(5, 1, 20)).toStrictEqual({first_old: 0, first_new: 0});
@@ -15,3 +15,46 @@ test("nextLocalMaxIndex test", () => {
     expect(nextLocalMaxIndex([0, 1, 0], -1)).toBe(1);
     expect(nextLocalMaxIndex([0, 1, 0], 1)).toBe(null);
 });
+
+test("mergeLiveDelta test", () => {
+    const data = {timestamps: ["t1", "t2", "t3"], values: {C1: {a: [1, 2, 3], b: [4, 5, 6]}}};
+    const delta = {timestamps: ["t3", "t4"], values: {C1: {a: [7, 8]}}, window_start: "t2"};
+    expect(mergeLiveDelta(data, delta)).toStrictEqual({
+        timestamps: ["t2", "t3", "t4"],
+        values: {C1: {a: [2, 7, 8], b: [5, null, null]}},
+        window_start: "t2"
+    });
+    const emptyDelta = {timestamps: [], values: {}, window_start: "t1"};
+    expect(mergeLiveDelta(data, emptyDelta).values).toStrictEqual(data.values);
+});
+
+test("mergeLiveDelta replaces the window that was still open", () => {
+    // the last timestamp labeled the open 12:00-13:00 window with the time of the query
+    const data = {timestamps: ["2024-01-01T11:00:00Z", "2024-01-01T12:00:00Z", "2024-01-01T12:34:56Z"], values: {C1: {a: [1, 2, 3]}}};
+    const delta = {timestamps: ["2024-01-01T13:00:00Z", "2024-01-01T13:05:00Z"], values: {C1: {a: [4, 5]}},
+        window_start: "2024-01-01T11:00:00Z", replace_from: "2024-01-01T12:00:00Z"};
+    expect(mergeLiveDelta(data, delta)).toStrictEqual({
+        timestamps: ["2024-01-01T11:00:00Z", "2024-01-01T12:00:00Z", "2024-01-01T13:00:00Z", "2024-01-01T13:05:00Z"],
+        values: {C1: {a: [1, 2, 4, 5]}},
+        window_start: "2024-01-01T11:00:00Z",
+        replace_from: "2024-01-01T12:00:00Z"
+    });
+});
+
+test("decodeTimeseries test", () => {
+    const header = JSON.stringify({start: "2023-01-01T00:00:00Z", step: 3600, length: 3,
+        locations: ["a", "b"], series: [["C1", 0], ["C1", 1]], extra: {version: "v"}});
+    const headerBytes = new TextEncoder().encode(header.padEnd(Math.ceil(header.length / 4) * 4));
+    const buffer = new ArrayBuffer(8 + headerBytes.length + 2 * 3 * 4 + 2);
+    const view = new DataView(buffer);
+    new Uint8Array(buffer, 0, 4).set(new TextEncoder().encode("CVTS"));
+    view.setUint32(4, headerBytes.length, true);
+    new Uint8Array(buffer, 8).set(headerBytes);
+    new Float32Array(buffer, 8 + headerBytes.length, 6).set([1, 2, 3, 4, NaN, 6]);
+    new Uint8Array(buffer, 8 + headerBytes.length + 24).set([0b111, 0b101]);
+    expect(decodeTimeseries(buffer)).toStrictEqual({
+        version: "v",
+        timestamps: ["2023-01-01T00:00:00Z", "2023-01-01T01:00:00Z", "2023-01-01T02:00:00Z"],
+        values: {C1: {a: [1, 2, 3], b: [4, null, 6]}}
+    });
+});
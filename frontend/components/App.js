@@ -44,7 +44,7 @@ import MapboxDrawStyles from './MapboxDrawStyles';
 
 import { booleanContains, point, center } from '@turf/turf';
 
-import { dayjs, dayjsSetLocaleAndTimezone, timestampBetween, nearestTimestampIndexAbove, formatTimestamp, maxFromArray, minFromArray, nextLocalMaxIndex, prevLocalMaxIndex, getRgbForPercentage, getRgbForPercentageSameHue } from './Utils';
+import { dayjs, dayjsSetLocaleAndTimezone, timestampBetween, nearestTimestampIndexAbove, formatTimestamp, maxFromArray, minFromArray, nextLocalMaxIndex, prevLocalMaxIndex, getRgbForPercentage, getRgbForPercentageSameHue, mergeLiveDelta, TIMESERIES_MIMETYPE, parseTimeseriesResponse } from './Utils';
 import Toolbar from './Toolbar';
 import StatusPane from './StatusPane';
 import CustomSlider from './CustomSlider';
@@ -236,7 +236,7 @@ function gotoLoginIf401(response) {
 
 let tC_start;
 
-function App({grid, parishesMapping, initialViewState, hasDensity, hasLive, measurements, columnRadius, locale, timezone}) {
+function App({grid, parishesMapping, initialViewState, hasDensity, hasLive, hasPredictionStream, measurements, columnRadius, locale, timezone}) {
   if(!dayjsLocaleSet && locale) { // TODO limpar/simplificar código
     dayjsSetLocaleAndTimezone(locale, timezone);
     dayjsLocaleSet = true;
@@ -351,13 +351,13 @@ function App({grid, parishesMapping, initialViewState, hasDensity, hasLive, meas
     const url = backendUrl + "/history" + "?start=" + start + "&end=" + end
       + "&every=" + everyNumber + everyUnit + locations;
     const start_date = Date.now();
-    fetch(url, {credentials: "include"})
+    fetch(url, {credentials: "include", headers: timeseriesHeaders})
       .then(r => {
         gotoLoginIf401(r);
         const end_date = Date.now();
         console.log(`load time: ${(end_date - start_date) / 1000}`);
         tC_start = Date.now();
-        return r.json()
+        return parseTimeseriesResponse(r)
       }).then(data => {
         const setData = () => {
           changeStatus(statuses.viewingHistory);
@@ -371,12 +371,16 @@ function App({grid, parishesMapping, initialViewState, hasDensity, hasLive, meas
       });
   }
 
+  // data endpoints answer in the compact binary format when asked to, falling back to JSON
+  const timeseriesHeaders = {Accept: TIMESERIES_MIMETYPE + ", application/json;q=0.9"};
+
   function loadLive() {
     changeStatus(statuses.loadingLive);
-    fetch(backendUrl + "/live", {credentials: "include"})
-      .then(r => {gotoLoginIf401(r); return r.json()})
+    fetch(backendUrl + "/live", {credentials: "include", headers: timeseriesHeaders})
+      .then(r => {gotoLoginIf401(r); return parseTimeseriesResponse(r)})
       .then(data => {
         changeStatus(statuses.viewingLive);
+        liveData.current = data;
         setRawData(data);
         const timestampIndex = data.timestamps.length - 1;
         setSelectedTimestamp(timestampIndex);
@@ -385,6 +389,9 @@ function App({grid, parishesMapping, initialViewState, hasDensity, hasLive, meas
       });
   }
 
+  // latest live data, kept in a ref since it's read from a timeout callback
+  const liveData = useRef(null);
+
   const client_id = useRef(null);
 
   function getPredictionClientId() {
@@ -413,6 +420,24 @@ function App({grid, parishesMapping, initialViewState, hasDensity, hasLive, meas
 
   function loadPrediction() {
     changeStatus(statuses.loadingPrediction);
+    if(!hasPredictionStream) {
+      loadPredictionByPolling();
+      return;
+    }
+    // the stream pushes the prediction as soon as it's available; falls back to polling if it fails
+    const source = new EventSource(backendUrl + "/prediction/stream", {withCredentials: true});
+    source.onmessage = e => {
+      source.close();
+      changeStatus(statuses.viewingPrediction);
+      setRawData(JSON.parse(e.data));
+    };
+    source.onerror = () => {
+      source.close();
+      loadPredictionByPolling();
+    };
+  }
+
+  function loadPredictionByPolling() {
     getPredictionClientId()
       .then(v => {
         client_id.current = v;
@@ -448,13 +473,17 @@ function App({grid, parishesMapping, initialViewState, hasDensity, hasLive, meas
   }
 
   function loadLiveNewData() {
-    const url = backendUrl + "/live";
-    fetch(url, {credentials: "include"})
-      .then(r => {gotoLoginIf401(r); return r.json()})
-      .then(data => {
-        if(!data.timestamps || data.timestamps.length === 0) {
+    const lastTimestamp = liveData.current.timestamps.at(-1);
+    const url = backendUrl + "/live" + (lastTimestamp ? "?since=" + lastTimestamp : "");
+    fetch(url, {credentials: "include", headers: timeseriesHeaders})
+      .then(r => {gotoLoginIf401(r); return parseTimeseriesResponse(r)})
+      .then(delta => {
+        if(!delta.timestamps || delta.timestamps.length === 0) {
           setNextTimeout();
         } else {
+          // connectors that don't support "since" return the whole window
+          const data = delta.window_start === undefined ? delta : mergeLiveDelta(liveData.current, delta);
+          liveData.current = data;
           if(currentStatusIs(statuses.viewingLive)) {
             if(data.timestamps.includes(selectedTimestampValue.current)) {
               setRawData(data);
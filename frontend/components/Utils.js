@@ -204,3 +204,79 @@ export function nearestTimestampIndexAbove(t, ts) {
     }
   }
 }
+
+// merges the response of /live?since=<last timestamp> into the current live data:
+// timestamps before delta.window_start are dropped, and timestamps after delta.replace_from
+// (which include the last one, possibly labeling a window that was still open) are replaced
+// by the ones in the delta; without replace_from, from the first one in the delta onwards
+export function mergeLiveDelta(data, delta) {
+  const firstNew = delta.timestamps.length > 0 ? delta.timestamps[0] : null;
+  const kept = delta.replace_from !== undefined
+    ? t => t <= delta.replace_from
+    : t => firstNew === null || t < firstNew;
+  let first = 0;
+  while(first < data.timestamps.length && data.timestamps[first] < delta.window_start)
+    ++first;
+  let last = first;
+  while(last < data.timestamps.length && kept(data.timestamps[last]))
+    ++last;
+  const timestamps = data.timestamps.slice(first, last).concat(delta.timestamps);
+  const values = {};
+  const metrics = new Set([...Object.keys(data.values), ...Object.keys(delta.values)]);
+  for(const metric of metrics) {
+    const oldLocations = data.values[metric] || {};
+    const newLocations = delta.values[metric] || {};
+    values[metric] = {};
+    for(const location of new Set([...Object.keys(oldLocations), ...Object.keys(newLocations)])) {
+      const oldValues = oldLocations[location] ? oldLocations[location].slice(first, last) : new Array(last - first).fill(null);
+      const newValues = newLocations[location] || new Array(delta.timestamps.length).fill(null);
+      values[metric][location] = oldValues.concat(newValues);
+    }
+  }
+  return {...delta, timestamps, values};
+}
+
+export const TIMESERIES_MIMETYPE = "application/vnd.crowding.timeseries";
+
+// decodes the compact binary time series format (see backend/timeseries_format.py) into
+// the same {timestamps, values} object as the JSON responses, with nulls for missing values
+export function decodeTimeseries(buffer) {
+  const view = new DataView(buffer);
+  const headerLength = view.getUint32(4, true);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+  const length = header.length;
+  let timestamps = header.timestamps;
+  if(timestamps === undefined) {
+    const start = Date.parse(header.start);
+    timestamps = [];
+    for(let i = 0; i < length; ++i)
+      timestamps.push(new Date(start + i * header.step * 1000).toISOString().replace(".000Z", "Z"));
+  }
+  const floats = new Float32Array(buffer, 8 + headerLength, header.series.length * length);
+  const bitmapSize = Math.ceil(length / 8);
+  const bitmaps = new Uint8Array(buffer, 8 + headerLength + floats.byteLength);
+  const values = {};
+  header.series.forEach(([metric, locationIndex], s) => {
+    const series = new Array(length);
+    for(let i = 0; i < length; ++i) {
+      const present = bitmaps[s * bitmapSize + (i >> 3)] & (1 << (i & 7));
+      series[i] = present ? floats[s * length + i] : null;
+    }
+    const location = header.locations[locationIndex];
+    if(metric === null) {
+      values[location] = series;
+    } else {
+      if(!(metric in values))
+        values[metric] = {};
+      values[metric][location] = series;
+    }
+  });
+  return {...header.extra, timestamps, values};
+}
+
+// parses a data endpoint response, which is binary when the backend honoured the Accept header
+export function parseTimeseriesResponse(response) {
+  if((response.headers.get("Content-Type") || "").startsWith(TIMESERIES_MIMETYPE))
+    return response.arrayBuffer().then(decodeTimeseries);
+  return response.json();
+}